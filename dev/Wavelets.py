@@ -1,4 +1,15 @@
 import numpy as NP
+import copy
+from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from multiprocessing.sharedctypes import RawArray
+try:
+    # scipy.fftpack transforms single precision arrays in single
+    # precision; numpy.fft always computes in double precision
+    from scipy import fftpack as _fftpack
+except ImportError:
+    _fftpack = None
 
 """
 A module which implements the continuous wavelet transform
@@ -14,11 +25,22 @@ DOG4       : 4th Derivative Of Gaussian
 Haar       : Unnormalised version of continuous Haar transform
 HaarW      : Normalised Haar
 
+FilterBank : LRU cache of wavelet filter banks, shared between transforms
+             of series of equal length
+blockcwt   : out of core transform of a long series, block by block,
+             into a memory mapped .npy file
+SlidingCwt : incremental transform of a stream of data, returning
+             coefficients as they are finalised
+getscales  : the scales Cwt uses for a given data length
+
 Usage e.g.
 wavelet=Morlet(data, largestscale=2, notes=0, order=2, scaling="log")
- data:  Numeric array of data (float), with length ndata.
+ data:  Numeric array of data (float), with length ndata,
+        or 2-d array (nchannel,ndata) e.g. the LYRA channels,
+        which share the wavelets and are transformed together.
         Optimum length is a power of 2 (for FFT)
         Worst-case length is a prime
+        (use pad to transform at the next fast fft length)
  largestscale:
         largest scale as inverse fraction of length
         scale = len(data)/largestscale
@@ -30,9 +52,43 @@ wavelet=Morlet(data, largestscale=2, notes=0, order=2, scaling="log")
  scaling: "linear" or "log" scaling of the wavelet scale.
         Note that feature width in the scale direction
         is constant on a log scale.
+ maxbytes: memory budget for transforming several scales at once
+        (default Cwt.maxbytes, 0 for one scale at a time)
+ bank:  a FilterBank; the Fourier transform of the wavelet at each
+        scale is taken from (or stored in) the bank rather than
+        recomputed for every transform
+ real:  data are real, use rfft.  Analytic wavelets (Morlet, Paul)
+        are zero at negative frequencies so only the positive half
+        of the spectrum is used; for the other families the wavelet
+        is Hermitian and the coefficients are real (irfft).
+        Differs from the complex transform only through the Nyquist
+        term: < 1e-12 of the largest coefficient, except Haar (~2e-6)
+ precision: "double" or "single".  Single precision keeps the
+        data, frequencies, wavelet kernels and data spectrum in
+        float32/complex64, and halves the memory per chunk.  The
+        complex forward fft and the inverse ffts are scipy.fftpack,
+        in single precision (irfft from the packed spectrum).  The
+        real forward rfft is numpy.fft, in double precision, cast
+        once to complex64.  Without scipy all ffts are numpy.fft,
+        in double precision.  Compared to double precision, for
+        series from 2**12 to 2**20 long, the largest coefficient
+        error is < 1e-6 of the largest coefficient.
+        (wavelet.cwt is complex64 in both cases, ~6e-8)
+ pad:   None, or "zero", "reflect" or "mean".  Pad the data (half at
+        each end) to the next length with no prime factors larger
+        than 5, transform, and crop the coefficients back to ndata
+ backend: how the chunks of scales are computed
+        "serial":  one after the other (default)
+        "thread":  by a pool of threads
+        "process": by a pool of processes, writing into
+                   shared memory
+ workers: number of threads or processes
+ store: if False the coefficients are not computed; getpower and
+        scaleaverage compute what they need from the fft of the data
         
 Attributes of instance:
 wavelet.cwt:       2-d array of Wavelet coefficients, (nscales,ndata)
+                   or (nchannel,nscales,ndata) for 2-d data
 wavelet.nscale:    Number of scale intervals
 wavelet.scales:    Array of scale values
                    Note that meaning of the scale will depend on the family
@@ -40,6 +96,14 @@ wavelet.fourierwl: Factor to multiply scale by to get scale
                    of equivalent FFT
                    Using this factor, different wavelet families will
                    have comparable scales
+wavelet.nfft:      Length of the fft used (ndata unless padded)
+wavelet.getcoimask(): boolean (nscales,ndata) array, True inside the
+                   cone of influence, where edge effects matter
+wavelet.getpower(period1,period2): power at the scales with Fourier
+                   period (fourierwl*scale) in [period1,period2)
+wavelet.scaleaverage(period1,period2): scale averaged power time
+                   series (T&C eq 24), accumulated a chunk of scales
+                   at a time (maxbytes=0: one scale at a time)
 
 References:
 A practical guide to wavelet analysis
@@ -53,28 +117,141 @@ updates:
 (25/07/08): log and lin scale increment in same direction!
             swap indices in 2-d coeffiecient matrix
             explicit scaling of scale axis
+(18/10/26): compute chunks of scales together, one multi-row ifft
+            per chunk, with chunk size set by a memory budget
+            FilterBank cache of psihat for repeated transforms
+            wf of every family is an array expression, no per element
+            loops; Paul and DOG no longer set Cwt.fourierwl
+            real (rfft) and single precision transforms
+            padding to a fast fft length, cone of influence mask
+            odd length fft grid fixed: was one bin out at +-pi
+            explicit scales, blockcwt for series too long for memory
+            2-d data: several channels in one transform
+            thread and process pool backends
+            band limited power, scale averaged power, store=False
+            SlidingCwt for streamed data
 """
 
+def _log2(x):
+    # utility function to return (integer) log2
+    return int( NP.log(float(x))/ NP.log(2.0)+0.0001 )
+
+def getscales(ndata, largestscale=1, notes=0, scaling='linear'):
+    """
+    returns the array of scales used by Cwt for data of length ndata
+    if scaling is "log", notes per octave (at least 1) down to a
+    smallest scale of 2, else a linear scale from 2
+    """
+    if scaling=="log":
+        if notes<=0: notes=1 
+        # adjust nscale so smallest scale is 2 
+        noctave=_log2( ndata/largestscale/2 )
+        nscale=notes*noctave
+        scales=NP.zeros(nscale,float)
+        for j in range(nscale):
+            scales[j] = ndata/(largestscale*(2.0**(float(nscale-1-j)/notes)))
+    elif scaling=="linear":
+        nmax=ndata/largestscale/2
+        scales=NP.arange(float(2),float(nmax))
+    else: raise ValueError, "scaling must be linear or log"
+    return scales
+
+def _packed(spectrum, n):
+    """
+    returns the first n//2+1 terms of the spectrum of a real series of
+    length n (as from rfft) in the packed real order of fftpack.irfft
+    """
+    packed=NP.empty(spectrum.shape[:-1]+(n,), spectrum.real.dtype)
+    m=(n-1)//2
+    packed[...,0]=spectrum[...,0].real
+    packed[...,1:2*m+1:2]=spectrum[...,1:m+1].real
+    packed[...,2:2*m+1:2]=spectrum[...,1:m+1].imag
+    if n%2==0:
+        packed[...,n-1]=spectrum[...,n//2].real
+    return packed
+
+def _sharedarray(shape, dtype):
+    """
+    returns a multiprocessing RawArray, and an array of shape and dtype
+    that uses it as its buffer
+    """
+    dtype=NP.dtype(dtype)
+    raw=RawArray('b', int(NP.prod(shape))*dtype.itemsize)
+    return raw, NP.frombuffer(raw, dtype).reshape(shape)
+
+# state of a process pool worker of Cwt, set by _initworker
+_worker={}
+
+def _initworker(wavelet, omega, shared):
+    _worker["wavelet"]=wavelet
+    _worker["omega"]=omega
+    _worker["psihat"]=None
+    for name, (raw, shape, dtype) in shared.items():
+        _worker[name]=NP.frombuffer(raw, dtype).reshape(shape)
+
+def _chunkworker(chunk):
+    lo, hi = chunk
+    w=_worker
+    w["cwt"][...,lo:hi,:] = w["wavelet"]._coefficients(lo, hi, w["omega"],
+                                                 w["datahat"], w["psihat"])
+
+def _nextfastlen(n):
+    """
+    returns the smallest integer >= n with no prime factors larger than 5
+    """
+    best=2**int(NP.ceil(NP.log2(n)))
+    p5=1
+    while p5 < best:
+        p35=p5
+        while p35 < best:
+            # smallest power of 2 taking p35 to at least n
+            p2=1
+            while p35*p2 < n:
+                p2*=2
+            best=min(best, p35*p2)
+            p35*=3
+        p5*=5
+    return best
+
 class Cwt:
     """
     Base class for continuous wavelet transforms
     Implements cwt via the Fourier transform
     Used by subclass which provides the method wf(self,s_omega)
     wf is the Fourier transform of the wavelet function.
+    wf must be an array expression in s_omega, which is a 2-d array
+    with one row per scale (self.currentscale is the matching column
+    of scales).
     Returns an instance.
     """
 
     fourierwl=1.00
+    # memory budget for the batched transform and the temporary storage
+    # (s_omega, psihat, convhat, W) needed per element of a chunk
+    maxbytes=2**27
+    _bytesperpoint=64
+    # true if the wavelet is zero at negative frequencies
+    analytic=False
+    # e-folding time of the wavelet power for a spike at the edge,
+    # as a multiple of scale, which defines the cone of influence (T&C)
+    efold=NP.sqrt(2.0)
+    # padding modes, passed to NP.pad
+    _padmodes={"zero":"constant", "reflect":"reflect", "mean":"mean"}
 
     def _log2(self, x):
         # utility function to return (integer) log2
-        return int( NP.log(float(x))/ NP.log(2.0)+0.0001 )
+        return _log2(x)
 
-    def __init__(self, data, largestscale=1, notes=0, order=2, scaling='linear'):
+    def __init__(self, data, largestscale=1, notes=0, order=2, scaling='linear',
+                 maxbytes=None, bank=None, real=False, precision='double',
+                 pad=None, scales=None, backend='serial', workers=1,
+                 store=True):
         """
         Continuous wavelet transform of data
 
         data:    data in array to transform, length must be power of 2
+                 or a 2-d array (nchannel,ndata) of several series,
+                 transformed together with the same wavelets
         notes:   number of scale intervals per octave
         largestscale: largest scale as inverse fraction of length
                  of data array
@@ -82,28 +259,223 @@ class Cwt:
                  smallest scale should be >= 2 for meaningful data
         order:   Order of wavelet basis function for some families
         scaling: Linear or log
+        maxbytes: memory budget (bytes) for the temporary arrays used when
+                 a chunk of scales is transformed at once.
+                 Default is Cwt.maxbytes; 0 transforms one scale at a time
+        bank:    FilterBank holding the wavelet at each scale for
+                 transforms of this family, order, length and scales
+        real:    data are real, transform with rfft
+        precision: "double" or "single" precision arithmetic
+        pad:     None, or "zero", "reflect" or "mean" padding to a
+                 fast fft length
+        scales:  array of scales to use instead of those given by
+                 largestscale, notes and scaling
+        backend: "serial", "thread" or "process" computation of the
+                 chunks of scales
+        workers: number of threads or processes for the backend
+        store:   compute and store the coefficients, self.cwt.  If False
+                 self.cwt is None and getpower and scaleaverage
+                 transform only the scales they need
         """
-        ndata = len(data)
+        data=NP.asarray(data)
+        ndata = data.shape[-1]
         self.order=order
         self.scale=largestscale
-        self._setscales(ndata,largestscale,notes,scaling)
-        self.cwt= NP.zeros((self.nscale,ndata), NP.complex64)
-        omega= NP.array(range(0,ndata/2)+range(-ndata/2,0))*(2.0*NP.pi/ndata)
-        datahat=NP.fft.fft(data)
+        self.scaling=scaling
+        self.ndata=ndata
+        self.real=real
+        if precision=="double":
+            self.dtype=NP.float64
+        elif precision=="single":
+            self.dtype=NP.float32
+        else: raise ValueError("precision must be double or single")
+        # transform in single precision, which halves the temporary
+        # storage per element of a chunk
+        self._single=self.dtype==NP.float32 and _fftpack is not None
+        if self._single:
+            self._bytesperpoint=self._bytesperpoint//2
+        if pad is None:
+            self.nfft=ndata
+        elif pad in self._padmodes:
+            self.nfft=_nextfastlen(ndata)
+        else: raise ValueError("pad must be None, zero, reflect or mean")
+        if backend not in ("serial", "thread", "process"):
+            raise ValueError("backend must be serial, thread or process")
+        if backend=="serial": workers=1
+        self.pad=pad
+        # data starts at offset in the (padded) fft
+        self.offset=(self.nfft-ndata)//2
+        if scales is None:
+            self._setscales(ndata,largestscale,notes,scaling)
+        else:
+            self.scales=NP.array(scales, float)
+            self.nscale=len(self.scales)
+        # one (nscale,ndata) array of coefficients per channel
+        shape=data.shape[:-1]+(self.nscale,ndata)
+        self.shape=shape
+        if not store:
+            self.cwt=None
+        elif backend=="process":
+            cwtraw, self.cwt = _sharedarray(shape, NP.complex64)
+        else:
+            self.cwt= NP.zeros(shape, NP.complex64)
+        if self.dtype==NP.float32:
+            data=data.astype(NP.iscomplexobj(data) and NP.complex64 or NP.float32)
+        if self.nfft > ndata:
+            widths=[(0,0)]*(data.ndim-1)+[(self.offset, self.nfft-ndata-self.offset)]
+            data=NP.pad(data, widths, mode=self._padmodes[pad])
+        nfft=self.nfft
+        if real:
+            datahat=NP.fft.rfft(data)
+            omega= NP.arange(datahat.shape[-1], dtype=self.dtype)*(2.0*NP.pi/nfft)
+            if self.analytic:
+                # the wavelet is zero at negative frequencies, and at the
+                # Nyquist frequency, which the full fft grid puts at -pi
+                nfreq=(nfft+1)//2
+                datahat=datahat[...,0:nfreq]
+                omega=omega[0:nfreq]
+        else:
+            omega= NP.concatenate((NP.arange(0,(nfft+1)//2),
+                                   NP.arange(-(nfft//2),0)))*(2.0*NP.pi/nfft)
+            omega=omega.astype(self.dtype, copy=False)
+            if self._single:
+                datahat=_fftpack.fft(data)
+            else:
+                datahat=NP.fft.fft(data)
+        if self.dtype==NP.float32:
+            datahat=datahat.astype(NP.complex64, copy=False)
         self.fftdata=datahat
+        # each channel's spectrum multiplies every row (scale) of psihat
+        datahat=datahat[...,NP.newaxis,:]
         #self.psihat0=self.wf(omega*self.scales[3*self.nscale/4])
-        # loop over scales and compute wvelet coeffiecients at each scale
-        # using the fft to do the convolution
-        for scaleindex in range(self.nscale):
-            currentscale=self.scales[scaleindex]
-            self.currentscale=currentscale  # for internal use
-            s_omega = omega*currentscale
-            psihat=self.wf(s_omega)
-            psihat = psihat *  NP.sqrt(2.0*NP.pi*currentscale)
-            convhat = psihat * datahat
-            W    = NP.fft.ifft(convhat)
-            self.cwt[scaleindex,0:ndata] = W 
+        bankpsihat = None
+        if bank is not None:
+            bankpsihat = bank.psihat(self, omega)
+        # kept to transform scales on demand
+        self._omega=omega
+        self._datahat=datahat
+        self._bankpsihat=bankpsihat
+        self._maxbytes=maxbytes
+        if not store:
+            return
+        # loop over chunks of scales and compute wavelet coefficients at
+        # each scale in the chunk using the fft to do the convolution
+        chunks=list(self._chunks(maxbytes, data.size//ndata, workers))
+        if backend=="serial":
+            for lo, hi in chunks:
+                self.cwt[...,lo:hi,0:ndata] = self._coefficients(lo, hi, omega,
+                                                      datahat, bankpsihat)
+        elif backend=="thread":
+            def work(chunk):
+                lo, hi = chunk
+                # a copy per chunk, so each thread has its own currentscale
+                wavelet=copy.copy(self)
+                self.cwt[...,lo:hi,0:ndata] = wavelet._coefficients(lo, hi,
+                                                 omega, datahat, bankpsihat)
+            pool=ThreadPool(workers)
+            try:
+                pool.map(work, chunks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            # workers get the spectra through shared memory, and write
+            # their chunks straight into self.cwt
+            shared={"cwt": (cwtraw, shape, NP.complex64)}
+            for name, array in (("datahat", datahat), ("psihat", bankpsihat)):
+                if array is not None:
+                    raw, sharedarray = _sharedarray(array.shape, array.dtype)
+                    sharedarray[...] = array
+                    shared[name] = (raw, array.shape, array.dtype)
+            # the copy pickled to each worker leaves the arrays out
+            wavelet=copy.copy(self)
+            wavelet.cwt=None
+            wavelet.fftdata=None
+            wavelet._datahat=None
+            wavelet._bankpsihat=None
+            pool=Pool(workers, _initworker, (wavelet, omega, shared))
+            try:
+                pool.map(_chunkworker, chunks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
         return
+
+    def _coefficients(self, lo, hi, omega, datahat, bankpsihat=None):
+        """
+        returns the wavelet coefficients at scales[lo:hi], cropped to
+        the data
+        """
+        if bankpsihat is None:
+            psihat = self._psihat(omega, self.scales[lo:hi])
+        else:
+            psihat = bankpsihat[lo:hi]
+        convhat = psihat * datahat
+        W    = self._ifft(convhat)
+        return W[...,self.offset:self.offset+self.ndata]
+
+    def _ifft(self, convhat):
+        """
+        inverse fft of convhat, psihat*datahat for a chunk of scales,
+        giving the wavelet coefficients
+        """
+        if self._single:
+            # convhat is a temporary, so may be overwritten
+            if not self.real:
+                return _fftpack.ifft(convhat, axis=-1, overwrite_x=True)
+            if self.analytic:
+                return _fftpack.ifft(convhat, n=self.nfft, axis=-1)
+            return _fftpack.irfft(_packed(convhat, self.nfft), axis=-1,
+                                  overwrite_x=True)
+        if not self.real:
+            return NP.fft.ifft(convhat, axis=-1)
+        if self.analytic:
+            # negative frequencies are zero
+            return NP.fft.ifft(convhat, n=self.nfft, axis=-1)
+        return NP.fft.irfft(convhat, n=self.nfft, axis=-1)
+
+    def _chunks(self, maxbytes=None, nchannel=1, workers=1, start=0, stop=None):
+        """
+        yields (lo, hi) ranges of scale indices from start to stop, each
+        holding as many scales as fit in maxbytes of temporary storage,
+        shared between workers, and at least one chunk per worker
+        """
+        if maxbytes is None: maxbytes=self.maxbytes
+        if stop is None: stop=self.nscale
+        nchunk=int(maxbytes//(self._bytesperpoint*self.nfft*nchannel*workers))
+        nchunk=max(1, min(nchunk, -(-(stop-start)//workers)))
+        for lo in range(start, stop, nchunk):
+            yield lo, min(lo+nchunk, stop)
+
+    def _rows(self, start, stop):
+        """
+        yields (lo, hi, W), the coefficients W for chunks of scales from
+        start to stop, from self.cwt or transformed from the data
+        """
+        nchannel=int(NP.prod(self.shape[:-2]))
+        for lo, hi in self._chunks(self._maxbytes, nchannel, 1, start, stop):
+            if self.cwt is not None:
+                yield lo, hi, self.cwt[...,lo:hi,:]
+            else:
+                yield lo, hi, self._coefficients(lo, hi, self._omega,
+                                        self._datahat, self._bankpsihat)
+
+    def _psihat(self, omega, scales):
+        """
+        returns the Fourier transform of the wavelet at each of scales,
+        as a 2-d array (len(scales),len(omega))
+        """
+        # wf broadcasts, so evaluate all scales at once: one row per scale
+        scales = NP.asarray(scales, omega.dtype)
+        self.currentscale=scales[:,NP.newaxis]  # for internal use
+        s_omega = NP.outer(scales, omega)
+        psihat = self.wf(s_omega)
+        psihat = psihat * NP.sqrt(2.0*NP.pi*scales)[:,NP.newaxis]
+        if omega.dtype == NP.float32:
+            # keep to single precision whatever the constants in wf
+            psihat = psihat.astype(NP.iscomplexobj(psihat) and NP.complex64
+                                   or NP.float32, copy=False)
+        return psihat
     
     def _setscales(self,ndata,largestscale,notes,scaling):
         """
@@ -111,19 +483,8 @@ class Cwt:
         else a linear scale
         (25/07/08): fix notes!=0 case so smallest scale at [0]
         """
-        if scaling=="log":
-            if notes<=0: notes=1 
-            # adjust nscale so smallest scale is 2 
-            noctave=self._log2( ndata/largestscale/2 )
-            self.nscale=notes*noctave
-            self.scales=NP.zeros(self.nscale,float)
-            for j in range(self.nscale):
-                self.scales[j] = ndata/(self.scale*(2.0**(float(self.nscale-1-j)/notes)))
-        elif scaling=="linear":
-            nmax=ndata/largestscale/2
-            self.scales=NP.arange(float(2),float(nmax))
-            self.nscale=len(self.scales)
-        else: raise ValueError, "scaling must be linear or log"
+        self.scales=getscales(ndata,largestscale,notes,scaling)
+        self.nscale=len(self.scales)
         return
     
     def getdata(self):
@@ -133,11 +494,51 @@ class Cwt:
         return self.cwt
     def getcoefficients(self):
         return self.cwt
-    def getpower(self):
+    def getpower(self, period1=None, period2=None):
+        """
+        returns square of wavelet coefficient array, for all scales or
+        those with Fourier period in [period1,period2)
         """
-        returns square of wavelet coefficient array
+        lo, hi = self.getband(period1, period2)
+        if self.cwt is not None:
+            cwt=self.cwt[...,lo:hi,:]
+            return (cwt* NP.conjugate(cwt)).real
+        power=NP.zeros(self.shape[:-2]+(hi-lo,self.ndata), NP.float32)
+        for clo, chi, W in self._rows(lo, hi):
+            power[...,clo-lo:chi-lo,:]=(W* NP.conjugate(W)).real
+        return power
+    def getband(self, period1=None, period2=None):
         """
-        return (self.cwt* NP.conjugate(self.cwt)).real
+        returns (lo, hi), the scales[lo:hi] with Fourier period
+        (fourierwl*scale) in [period1,period2).  Scales are increasing
+        """
+        periods=self.fourierwl*self.scales
+        inband=NP.ones(self.nscale, bool)
+        if period1 is not None: inband&=(periods >= period1)
+        if period2 is not None: inband&=(periods < period2)
+        index=NP.nonzero(inband)[0]
+        if len(index)==0: raise ValueError("no scales in the period band")
+        return index[0], index[-1]+1
+    def scaleaverage(self, period1=None, period2=None, cdelta=1.0):
+        """
+        returns the scale averaged power over the scales with Fourier
+        period in [period1,period2), Torrence & Compo equation 24
+          sum of dj*|W|**2/scale/cdelta
+        (scales in samples, so dt cancels), dj the log2 spacing of the
+        scales and cdelta the reconstruction factor of the wavelet.
+        Power is accumulated a chunk of scales at a time, so only the
+        time series, (ndata) per channel, is stored
+        """
+        lo, hi = self.getband(period1, period2)
+        if self.nscale > 1:
+            dj=NP.gradient(NP.log2(self.scales))
+        else:
+            dj=NP.ones(1)
+        average=NP.zeros(self.shape[:-2]+(self.ndata,), float)
+        for clo, chi, W in self._rows(lo, hi):
+            weight=(dj[clo:chi]/self.scales[clo:chi])[:,NP.newaxis]
+            average+=((W* NP.conjugate(W)).real*weight).sum(axis=-2)
+        return average/cdelta
     def getscales(self):
         """
         returns array containing scales used in transform
@@ -148,19 +549,89 @@ class Cwt:
         return number of scales
         """
         return self.nscale
+    def getcoimask(self):
+        """
+        returns a boolean array (nscale,ndata), True inside the cone of
+        influence: within efold*scale of either end of the data
+        """
+        t=NP.arange(self.ndata)
+        edge=NP.minimum(t, self.ndata-1-t)
+        return edge[NP.newaxis,:] < self.efold*self.scales[:,NP.newaxis]
+
+class FilterBank:
+    """
+    Least recently used cache of wavelet filter banks.
+    A bank is the psihat matrix (nscale,ndata) of a transform, keyed by
+    (family, order, ndata, scales, scaling), so that transforms of many
+    series of the same length only pay for the fft of the data and the
+    multiply/ifft.
+    Banks are evicted, least recently used first, when there are more
+    than maxsize of them or they hold more than maxbytes in total.
+
+    Usage e.g.
+    bank=FilterBank(maxsize=4)
+    for segment in segments:
+        wavelet=Morlet(segment, 2, 8, scaling="log", bank=bank)
+    """
+
+    def __init__(self, maxsize=8, maxbytes=None):
+        self.maxsize=maxsize
+        self.maxbytes=maxbytes
+        self.banks=OrderedDict()
+        self.nbytes=0
+        self.hits=0
+        self.misses=0
+
+    def _key(self, wavelet, omega):
+        return (wavelet.__class__, wavelet.order, wavelet.nfft,
+                wavelet.scales.tobytes(), wavelet.scaling,
+                wavelet.real, omega.dtype.str)
+
+    def psihat(self, wavelet, omega):
+        """
+        returns the psihat matrix for the Cwt instance wavelet,
+        computing and storing it if it is not in the bank
+        """
+        key=self._key(wavelet, omega)
+        if key in self.banks:
+            self.hits+=1
+            psihat=self.banks.pop(key)
+        else:
+            self.misses+=1
+            psihat=wavelet._psihat(omega, wavelet.scales)
+            psihat.flags.writeable=False
+            self.nbytes+=psihat.nbytes
+        self.banks[key]=psihat
+        self._evict()
+        return psihat
+
+    def _evict(self):
+        # always keep the most recently used bank
+        while len(self.banks) > 1 and (len(self.banks) > self.maxsize or
+              (self.maxbytes is not None and self.nbytes > self.maxbytes)):
+            key, psihat = self.banks.popitem(last=False)
+            self.nbytes-=psihat.nbytes
+
+    def clear(self):
+        """
+        empties the bank
+        """
+        self.banks.clear()
+        self.nbytes=0
+
+    def __len__(self):
+        return len(self.banks)
 
 # wavelet classes    
 class Morlet(Cwt):
     """
     Morlet wavelet
     """
+    analytic=True
     _omega0=5.0
     fourierwl=4* NP.pi/(_omega0+ NP.sqrt(2.0+_omega0**2))
     def wf(self, s_omega):
-        H= NP.ones(len(s_omega))
-        n=len(s_omega)
-        for i in range(len(s_omega)):
-            if s_omega[i] < 0.0: H[i]=0.0
+        H= (s_omega >= 0.0)
         # !!!! note : was s_omega/8 before 17/6/03
         xhat=0.75112554*( NP.exp(-(s_omega-self._omega0)**2/2.0))*H
         return xhat
@@ -172,10 +643,6 @@ class MorletReal(Cwt):
     _omega0=5.0
     fourierwl=4* NP.pi/(_omega0+ NP.sqrt(2.0+_omega0**2))
     def wf(self, s_omega):
-        H= NP.ones(len(s_omega))
-        n=len(s_omega)
-        for i in range(len(s_omega)):
-            if s_omega[i] < 0.0: H[i]=0.0
         # !!!! note : was s_omega/8 before 17/6/03
         xhat=0.75112554*( NP.exp(-(s_omega-self._omega0)**2/2.0)+ NP.exp(-(s_omega+self._omega0)**2/2.0)- NP.exp(-(self._omega0)**2/2.0)+ NP.exp(-(self._omega0)**2/2.0))
         return xhat
@@ -184,11 +651,13 @@ class Paul4(Cwt):
     """
     Paul m=4 wavelet
     """
+    analytic=True
     fourierwl=4* NP.pi/(2.*4+1.)
+    efold=1.0/NP.sqrt(2.0)
     def wf(self, s_omega):
-        n=len(s_omega)
-        xhat= NP.zeros(n)
-        xhat[0:n/2]=0.11268723*s_omega[0:n/2]**4* NP.exp(-s_omega[0:n/2])
+        # zero at negative frequencies
+        s_omega= NP.maximum(s_omega, 0.0)
+        xhat=0.11268723*s_omega**4* NP.exp(-s_omega)
         #return 0.11268723*s_omega**2*exp(-s_omega)*H
         return xhat
 
@@ -196,11 +665,12 @@ class Paul2(Cwt):
     """
     Paul m=2 wavelet
     """
+    analytic=True
     fourierwl=4* NP.pi/(2.*2+1.)
+    efold=1.0/NP.sqrt(2.0)
     def wf(self, s_omega):
-        n=len(s_omega)
-        xhat= NP.zeros(n)
-        xhat[0:n/2]=1.1547005*s_omega[0:n/2]**2* NP.exp(-s_omega[0:n/2])
+        s_omega= NP.maximum(s_omega, 0.0)
+        xhat=1.1547005*s_omega**2* NP.exp(-s_omega)
         #return 0.11268723*s_omega**2*exp(-s_omega)*H
         return xhat
 
@@ -208,16 +678,19 @@ class Paul(Cwt):
     """
     Paul order m wavelet
     """
+    analytic=True
+    efold=1.0/NP.sqrt(2.0)
+    @property
+    def fourierwl(self):
+        return 4* NP.pi/(2.*self.order+1.)
     def wf(self, s_omega):
-        Cwt.fourierwl=4* NP.pi/(2.*self.order+1.)
         m=self.order
-        n=len(s_omega)
         normfactor=float(m)
         for i in range(1,2*m):
             normfactor=normfactor*i
         normfactor=2.0**m/ NP.sqrt(normfactor)
-        xhat= NP.zeros(n)
-        xhat[0:n/2]=normfactor*s_omega[0:n/2]**m* NP.exp(-s_omega[0:n/2])
+        s_omega= NP.maximum(s_omega, 0.0)
+        xhat=normfactor*s_omega**m* NP.exp(-s_omega)
         #return 0.11268723*s_omega**2*exp(-s_omega)*H
         return xhat
 
@@ -252,22 +725,22 @@ class DOG1(Cwt):
     """
     fourierwl=2.0* NP.pi/ NP.sqrt(1.5)
     def wf(self, s_omega):
-        dog1= NP.zeros(len(s_omega),complex64)
-        dog1.imag=s_omega* NP.exp(-s_omega**2/2.0)/sqrt(pi)
-        return dog1
+        return 1.0J*s_omega* NP.exp(-s_omega**2/2.0)/ NP.sqrt(NP.pi)
 
 class DOG(Cwt):
     """
     Derivative Gaussian wavelet of order m
     but reconstruction seems to work best with +!
     """
+    @property
+    def fourierwl(self):
+        return 2* NP.pi/ NP.sqrt(self.order+0.5)
     def wf(self, s_omega):
         try:
             from scipy.special import gamma
         except ImportError:
             print "Requires scipy gamma function"
             raise ImportError
-        Cwt.fourierwl=2* NP.pi/ NP.sqrt(self.order+0.5)
         m=self.order
         dog=1.0J**m*s_omega**m* NP.exp(-s_omega**2/2)/ NP.sqrt(gamma(self.order+0.5))
         return dog
@@ -282,13 +755,12 @@ class Haar(Cwt):
     # 2/8/05 constants adjusted to match artem eim
 
     fourierwl=1.0#1.83129  #2.0
+    efold=0.5  # support is +-scale/2
     def wf(self, s_omega):
-        haar= NP.zeros(len(s_omega),complex64)
-        om = s_omega[:]/self.currentscale
-        om[0]=1.0  #prevent divide error
+        om = s_omega/self.currentscale
+        om = NP.where(om == 0.0, 1.0, om)  #prevent divide error
         #haar.imag=4.0*sin(s_omega/2)**2/om
-        haar.imag=4.0* NP.sin(s_omega/4)**2/om
-        return haar
+        return 4.0J* NP.sin(s_omega/4)**2/om
 
 class HaarW(Cwt):
     """
@@ -300,13 +772,191 @@ class HaarW(Cwt):
     # normalised to unit power
 
     fourierwl=1.83129*1.2  #2.0
+    efold=1.0  # support is +-scale
     def wf(self, s_omega):
-        haar= NP.zeros(len(s_omega),complex64)
-        om = s_omega[:]#/self.currentscale
-        om[0]=1.0  #prevent divide error
+        om = s_omega#/self.currentscale
+        om = NP.where(om == 0.0, 1.0, om)  #prevent divide error
         #haar.imag=4.0*sin(s_omega/2)**2/om
-        haar.imag=4.0* NP.sin(s_omega/2)**2/om
-        return haar
+        return 4.0J* NP.sin(s_omega/2)**2/om
+
+def _overlap(wavelet, scales, nefold):
+    """
+    number of samples either side of a point that the wavelet at the
+    largest of scales reaches: nefold e-folding times
+    """
+    return int(NP.ceil(nefold*wavelet.efold*NP.max(scales)))
+
+def blockcwt(wavelet, data, filename, scales, blocksize=2**16, order=2,
+             output="power", pad="zero", nefold=4.0, **kwargs):
+    """
+    Out of core continuous wavelet transform of a long series, using
+    overlap-save: data are transformed in blocks of blocksize samples,
+    each extended at both ends by enough samples to cover the support
+    of the wavelet at the largest scale, and the middle of each block's
+    transform is written to a memory mapped .npy file.  Memory used is
+    set by blocksize and the scales, not by len(data).
+
+    wavelet:  wavelet class, e.g. Morlet
+    data:     1-d array of data, e.g. a NP.memmap or NP.load(...,
+              mmap_mode="r"); only one block is read at a time
+    filename: .npy file written with the (nscale,ndata) result
+    scales:   array of scales, e.g. getscales(ndata_of_a_day, ...)
+              The overlap, and so the cost, grows with the largest
+    blocksize: samples per block, rounded up so that blocks with their
+              overlap have a fast fft length
+    order:    order of wavelet for families with variable order
+    output:   "power" (float32) or "coefficients" (complex64)
+    pad:      "zero", "reflect" or "mean" for the data beyond the ends
+              of the series
+    nefold:   overlap in e-folding times (wavelet.efold*scale) of the
+              largest scale.  The wavelet is truncated there, where the
+              Morlet and DOG wavelets are down to exp(-nefold**2) of
+              their peak; Paul wavelets decay more slowly, so need more
+    kwargs:   passed to wavelet, e.g. real=True, precision="single"
+
+    returns the result as a NP.memmap opened on filename
+    """
+    if output=="power":
+        dtype=NP.float32
+    elif output=="coefficients":
+        dtype=NP.complex64
+    else: raise ValueError("output must be power or coefficients")
+    if pad not in Cwt._padmodes:
+        raise ValueError("pad must be zero, reflect or mean")
+    scales=NP.array(scales, float)
+    ndata=len(data)
+    overlap=_overlap(wavelet, scales, nefold)
+    nfft=_nextfastlen(blocksize+2*overlap)
+    blocksize=nfft-2*overlap
+    result=NP.lib.format.open_memmap(filename, mode="w+", dtype=dtype,
+                                     shape=(len(scales),ndata))
+    # every block has the same length, so the kernels are computed once
+    bank=FilterBank(maxsize=1)
+    for start in range(0, ndata, blocksize):
+        end=min(start+blocksize, ndata)
+        lo=max(start-overlap, 0)
+        hi=min(start+blocksize+overlap, ndata)
+        block=NP.asarray(data[lo:hi])
+        before=lo-(start-overlap)
+        after=nfft-before-len(block)
+        if before or after:
+            block=NP.pad(block, (before, after), mode=Cwt._padmodes[pad])
+        cw=wavelet(block, order=order, scales=scales, bank=bank, **kwargs)
+        # only the middle of the block is kept, so only it is squared
+        c=cw.cwt[:,overlap:overlap+end-start]
+        if output=="power":
+            result[:,start:end]=(c*NP.conjugate(c)).real
+        else:
+            result[:,start:end]=c
+    result.flush()
+    return result
+
+class SlidingCwt:
+    """
+    Incremental continuous wavelet transform of a stream of data.
+    Each call to append(block) transforms only the new samples plus
+    the overlap either side that the wavelet at the largest scale
+    reaches (as in blockcwt), so the cost per block is proportional to
+    the block size plus a constant, not to the length of the window.
+    A column of coefficients is final once overlap samples beyond it
+    have arrived, and append returns the columns finalised by the block.
+    The power of the most recent window of finalised columns is kept.
+
+    Usage e.g.
+    scales=getscales(4096, 1, 8, "log")
+    sliding=SlidingCwt(Morlet, scales, window=86400)
+    for block in blocks:
+        start, coefficients=sliding.append(block)
+        power=sliding.getpower()
+    start, coefficients=sliding.finish()
+
+    wavelet: wavelet class, e.g. Morlet
+    scales:  array of scales
+    window:  number of finalised columns of power kept
+    order:   order of wavelet for families with variable order
+    pad:     "zero", "reflect" or "mean" for the data before the
+             start, and (finish) after the end of the stream
+    nefold:  overlap in e-folding times of the largest scale, see
+             blockcwt
+    kwargs:  passed to wavelet, e.g. real=True, precision="single"
+    """
+
+    def __init__(self, wavelet, scales, window, order=2, pad="zero",
+                 nefold=4.0, **kwargs):
+        if pad not in Cwt._padmodes:
+            raise ValueError("pad must be zero, reflect or mean")
+        self.wavelet=wavelet
+        self.scales=NP.array(scales, float)
+        self.nscale=len(self.scales)
+        self.window=window
+        self.order=order
+        self.pad=pad
+        self.kwargs=kwargs
+        self.overlap=_overlap(wavelet, self.scales, nefold)
+        # samples appended, and columns finalised
+        self.ndata=0
+        self.nfinal=0
+        # the data from sample tailstart on, still needed
+        self.tail=NP.zeros(0)
+        self.tailstart=0
+        # power of the last window finalised columns, column t at t%window
+        self._ring=NP.zeros((self.nscale,window), NP.float32)
+        self.bank=FilterBank(maxsize=2)
+
+    def append(self, block):
+        """
+        adds block to the stream, returns (start, coefficients): the
+        (nscale,n) columns finalised, from sample start on
+        """
+        self.tail=NP.concatenate((self.tail, NP.asarray(block)))
+        self.ndata+=len(block)
+        return self._finalise(self.ndata-self.overlap, 0)
+
+    def finish(self):
+        """
+        ends the stream, padding after the last sample, and returns
+        (start, coefficients) for the remaining columns
+        """
+        return self._finalise(self.ndata, self.overlap)
+
+    def _finalise(self, stop, after):
+        """
+        transforms the columns from nfinal to stop, padding with after
+        samples after the data
+        """
+        start=self.nfinal
+        if stop <= start:
+            return start, NP.zeros((self.nscale,0), NP.complex64)
+        # samples start-overlap to stop+overlap; before the stream
+        # starts they are padding
+        first=max(start-self.overlap, 0)
+        segment=self.tail[first-self.tailstart:]
+        before=first-(start-self.overlap)
+        if before or after:
+            segment=NP.pad(segment, (before, after), mode=Cwt._padmodes[self.pad])
+        cw=self.wavelet(segment, order=self.order, scales=self.scales,
+                        bank=self.bank, pad="zero", **self.kwargs)
+        coefficients=cw.cwt[:,self.overlap:self.overlap+stop-start]
+        # keep the power in the window
+        n=min(stop-start, self.window)
+        index=NP.arange(stop-n, stop) % self.window
+        power=coefficients[:,-n:]
+        self._ring[:,index]=(power* NP.conjugate(power)).real
+        # drop the data no longer needed
+        self.nfinal=stop
+        keep=max(stop-self.overlap, 0)
+        self.tail=self.tail[keep-self.tailstart:]
+        self.tailstart=keep
+        return start, coefficients
+
+    def getpower(self):
+        """
+        returns the (nscale,n) power of the last n=min(window, finalised)
+        columns, in time order
+        """
+        n=min(self.window, self.nfinal)
+        index=NP.arange(self.nfinal-n, self.nfinal) % self.window
+        return self._ring[:,index]
 
 
 if __name__=="__main__":
@@ -0,0 +1,303 @@
+"""
+Benchmarks of the wavelet and Hurst hot paths, on synthetic LYRA-like data.
+
+Runs offline: the data are a red noise background at LYRA native cadence
+(0.05 s) with flares (fast rise, exponential decay) and short spikes, a
+day or a month long.  Each benchmark runs in its own process and records
+its best run time of --repeat runs (3 by default; the first run is cold),
+throughput (samples per second) and peak memory.  Peak memory is traced
+with tracemalloc where there is one (Python 3), and otherwise is the rise
+in peak resident set size on Linux (/proc/self/status).  Results
+are written as JSON, and can be compared with a stored baseline to flag
+regressions.  Benchmarks whose dependencies (kPyWavelet, sunpy, rpy2 and
+the R package fArma) are not installed are reported as skipped.
+
+Usage e.g.
+python benchmark.py --size day --output results.json
+python benchmark.py --size day --save baseline.json
+python benchmark.py --size day --compare baseline.json --tolerance 0.2
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Pipe
+
+import numpy as np
+
+# lyra_gi lives in the directory above this one
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import Wavelets
+
+# LYRA native cadence (seconds) and series lengths
+cadence = 0.05
+sizes = {'small': 2**16,
+         'day': int(86400/cadence),
+         'month': int(30*86400/cadence)}
+# samples the in-memory transforms (cwt, lyra_gi) take at each size, as
+# many as fit in a few GB
+inmemory = {'small': sizes['small'], 'day': 2**19, 'month': 2**20}
+
+
+def synthetic_lyra(n, dt=cadence, seed=0):
+    """Return a LYRA-like irradiance time series of n samples: red noise
+    about a constant background, about 10 flares and 50 spikes a day"""
+    rng = np.random.RandomState(seed)
+    days = n*dt/86400.0
+    # Red (Brownian) noise plus white detector noise
+    data = 1.0 + 0.01*np.cumsum(rng.randn(n))/np.sqrt(n)
+    data += 0.001*rng.randn(n)
+    # Flares: fast rise, exponential decay
+    for i in range(max(1, int(10*days))):
+        peak = rng.randint(0, n)
+        rise = rng.uniform(30.0, 300.0)/dt
+        decay = rng.uniform(300.0, 3000.0)/dt
+        lo = max(0, int(peak - 5*rise))
+        hi = min(n, int(peak + 10*decay))
+        t = np.arange(lo, hi) - peak
+        profile = np.where(t < 0, np.exp(-(t/rise)**2), np.exp(-t/decay))
+        data[lo:hi] += rng.uniform(0.01, 0.2)*profile
+    # Spikes: a few samples of large amplitude
+    for i in range(max(1, int(50*days))):
+        start = rng.randint(0, n - 10)
+        data[start:start + rng.randint(1, 10)] += rng.uniform(0.05, 0.5)
+    return data
+
+
+def timeseries(data, dt=cadence):
+    """The data as a pandas time series, as used by find_spike"""
+    import pandas
+    index = pandas.date_range(datetime.datetime(2012, 6, 8), periods=len(data),
+                              freq='%dL' % int(round(dt*1000)))
+    return pandas.Series(data, index=index)
+
+
+def inmemory_length(data):
+    """The samples of data the in-memory transforms take"""
+    for name, n in sizes.items():
+        if len(data) == n:
+            return inmemory[name]
+    return len(data)
+
+
+#
+# The benchmarks.  Each takes the data and returns the number of samples
+# it processed.  A benchmark raises ImportError if it cannot run here.
+#
+def bench_cwt(data):
+    n = inmemory_length(data)
+    Wavelets.Morlet(data[:n], 8, 4, scaling='log', pad='zero')
+    return n
+
+def bench_cwt_real_single(data):
+    n = inmemory_length(data)
+    Wavelets.Morlet(data[:n], 8, 4, scaling='log', pad='zero', real=True,
+                    precision='single')
+    return n
+
+def bench_blockcwt(data):
+    # at most a day, so that the power file stays a few GB
+    n = min(len(data), sizes['day'])
+    scales = Wavelets.getscales(4096, 1, 4, 'log')
+    handle, filename = tempfile.mkstemp(suffix='.npy')
+    os.close(handle)
+    try:
+        Wavelets.blockcwt(Wavelets.Morlet, data[:n], filename, scales,
+                          blocksize=2**16, real=True, precision='single')
+    finally:
+        os.remove(filename)
+    return n
+
+def bench_lyra_gi_transform(data):
+    import lyra_gi
+    import kPyWavelet as wvt
+    n = inmemory_length(data)
+    analyse = lyra_gi.lyra_gi(data[:n], cadence)
+    analyse.mother = wvt.wavelet.Morlet(6.)
+    analyse.transform()
+    return n
+
+def bench_find_spike(data):
+    import proba2gi
+    proba2gi.find_spike(timeseries(data))
+    return len(data)
+
+def bench_split_timeseries(data):
+    import proba2gi
+    ts = timeseries(data)
+    # one excluded range per 10 minutes of data
+    step = int(600/cadence)
+    timeranges = [proba2gi.SpikeTimeRange(ts.index[i], ts.index[i + step//10])
+                  for i in range(0, len(ts) - step, step)]
+    proba2gi.split_timeseries(ts, timeranges)
+    return len(data)
+
+def bench_hurst_fArma(data):
+    # importr raises RRuntimeError, not ImportError, for a missing R package
+    from rpy2.robjects.packages import isinstalled
+    if not isinstalled('fArma'):
+        raise ImportError('No R package named fArma')
+    import proba2gi
+    n = min(len(data), 2**14)
+    proba2gi.hurst_fArma(data[:n], function=['aggvarFit', 'rsFit'])
+    return n
+
+benchmarks = [('cwt', bench_cwt),
+              ('cwt_real_single', bench_cwt_real_single),
+              ('blockcwt', bench_blockcwt),
+              ('lyra_gi_transform', bench_lyra_gi_transform),
+              ('find_spike', bench_find_spike),
+              ('split_timeseries', bench_split_timeseries),
+              ('hurst_fArma', bench_hurst_fArma)]
+
+
+def _status(field):
+    """A size in bytes from /proc/self/status, e.g. VmRSS or VmHWM (peak)"""
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])*1024
+
+def _reset_peak():
+    """Reset the peak resident set size of this process to the current one
+    and return it in bytes, or None if that cannot be done here.  A forked
+    child starts with the peak of its parent, so this is needed before
+    measuring its own."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return _status('VmRSS')
+    except (IOError, OSError):
+        return None
+
+def _child(function, data, repeat, conn):
+    """Run a benchmark in a child process and send back the result"""
+    try:
+        try:
+            import tracemalloc
+            tracemalloc.start()
+            rss0 = None
+        except ImportError:
+            tracemalloc = None
+            rss0 = _reset_peak()
+        best = None
+        for i in range(repeat):
+            t0 = time.time()
+            nsamples = function(data)
+            elapsed = time.time() - t0
+            if best is None or elapsed < best:
+                best = elapsed
+        if tracemalloc is not None:
+            peak = tracemalloc.get_traced_memory()[1]
+        elif rss0 is not None:
+            peak = _status('VmHWM')
+            # lyra_gi resets the peak between the stages it measures, and
+            # keeps the highest
+            if 'lyra_gi' in sys.modules:
+                peak = max(peak, sys.modules['lyra_gi'].resident_peak())
+            peak = peak - rss0
+        else:
+            peak = None
+        conn.send({'seconds': best, 'samples': nsamples,
+                   'throughput': nsamples/max(best, 1e-9), 'peak_bytes': peak})
+    except ImportError as error:
+        conn.send({'skipped': str(error)})
+    except Exception as error:
+        conn.send({'error': '%s: %s' % (error.__class__.__name__, error)})
+    conn.close()
+
+def run(data, names=None, repeat=3, verbose=True):
+    """Run the benchmarks, each in its own process, and return the results,
+    the best of repeat runs"""
+    results = {}
+    for name, function in benchmarks:
+        if names and name not in names:
+            continue
+        parent, child = Pipe()
+        process = Process(target=_child, args=(function, data, repeat, child))
+        process.start()
+        result = parent.recv()
+        process.join()
+        results[name] = result
+        if verbose:
+            print(describe(name, result))
+    return results
+
+def describe(name, result):
+    if 'skipped' in result:
+        return '%-20s skipped (%s)' % (name, result['skipped'])
+    if 'error' in result:
+        return '%-20s error (%s)' % (name, result['error'])
+    if result['peak_bytes'] is None:
+        memory = '      n/a'
+    else:
+        memory = '%9.1f MB' % (result['peak_bytes']/2.0**20)
+    return '%-20s %9.3f s %12.0f samples/s %s' % (name,
+            result['seconds'], result['throughput'], memory)
+
+def compare(results, baseline, tolerance=0.2):
+    """Return a list of regressions: benchmarks whose throughput fell, or
+    peak memory rose, by more than the fractional tolerance.  Memory is
+    not compared where either peak was not measured (None or 0)."""
+    regressions = []
+    for name, result in results.items():
+        old = baseline.get(name)
+        if old is None or 'throughput' not in old or 'throughput' not in result:
+            continue
+        if result['throughput'] < old['throughput']*(1.0 - tolerance):
+            regressions.append('%s: throughput %.0f -> %.0f samples/s' %
+                               (name, old['throughput'], result['throughput']))
+        if old.get('peak_bytes') and result.get('peak_bytes') and \
+           result['peak_bytes'] > old['peak_bytes']*(1.0 + tolerance):
+            regressions.append('%s: peak memory %.1f -> %.1f MB' %
+                               (name, old['peak_bytes']/2.0**20,
+                                result['peak_bytes']/2.0**20))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--size', choices=sorted(sizes), default='day')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each benchmark, best is kept')
+    parser.add_argument('--only', nargs='*', help='benchmarks to run')
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--save', help='write the results as a baseline')
+    parser.add_argument('--compare', help='baseline to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+
+    data = synthetic_lyra(sizes[args.size])
+    results = run(data, args.only, args.repeat)
+    record = {'size': args.size,
+              'samples': len(data),
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'machine': platform.platform(),
+              'date': datetime.datetime.utcnow().isoformat(),
+              'results': results}
+    for filename in (args.output, args.save):
+        if filename:
+            with open(filename, 'w') as f:
+                json.dump(record, f, indent=1, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('size') != args.size:
+            print('Baseline is for size %s' % baseline.get('size'))
+            return 2
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
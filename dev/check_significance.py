@@ -0,0 +1,66 @@
+"""
+Correctness harness for the significance level cache in lyra_gi.py.
+
+The cache keeps the white noise levels and applies the red noise
+spectrum of each alpha to them.  Checks that the levels of each alpha,
+mostly close to 1 as for 20 Hz LYRA data, agree with
+wvt.wavelet.significance for that alpha, and that a second request is a
+cache hit with the same levels.
+
+Run as
+python check_significance.py
+"""
+import os
+import sys
+import numpy as np
+
+# lyra_gi lives in the directory above this one
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import kPyWavelet as wvt
+import lyra_gi
+
+# relative tolerance of the cached levels
+rtol = 1e-12
+
+def check_alpha(cache, alpha, mother, dt=0.05, n0=2**16):
+    """
+    returns the largest relative difference between the cached and the
+    uncached levels, and whether the second request hit the cache with
+    the same levels
+    """
+    scales = 2*dt * 2**(np.arange(60) * 0.25)
+    diff = 0.0
+    repeat = True
+    for sigma_test, dof in [(0, -1), (1, n0 - scales)]:
+        signif, fft_theor = wvt.wavelet.significance(1.0, dt, scales, sigma_test, alpha, significance_level=0.95, dof=dof, wavelet=mother)
+        hits = cache.hits
+        cached = cache.significance(1.0, dt, scales, sigma_test, alpha, 0.95, mother, dof=dof)
+        again = cache.significance(1.0, dt, scales, sigma_test, alpha, 0.95, mother, dof=dof)
+        diff = max(diff, np.abs(cached[0]/signif - 1).max())
+        # for sigma_test 1, significance fills in the levels over its
+        # fft_theor and returns them as both
+        if sigma_test == 0:
+            diff = max(diff, np.abs(cached[1]/fft_theor - 1).max())
+        repeat = repeat and cache.hits >= hits + 1 and \
+            all((a == b).all() for a, b in zip(cached, again))
+    return diff, repeat
+
+def main():
+    np.random.seed(0)
+    cache = lyra_gi.significance_cache()
+    alphas = np.concatenate(([0.0, 0.5, 0.9, 0.99, 0.999, 0.9997, 0.99969,
+                              0.99999, 0.999995], 1 - 10**np.random.uniform(-5.9, -1, 20)))
+    failures = 0
+    for mother in [wvt.wavelet.DOG(1), wvt.wavelet.DOG(2), wvt.wavelet.Morlet(6.)]:
+        for alpha in alphas:
+            diff, repeat = check_alpha(cache, alpha, mother)
+            ok = diff <= rtol and repeat
+            if not ok:
+                failures += 1
+            print('%-12s alpha %.7f  levels %.3g  %s' % (lyra_gi.mother_label(mother),
+                  alpha, diff, 'ok' if ok else 'FAIL'))
+    return failures
+
+if __name__ == '__main__':
+    sys.exit(main())
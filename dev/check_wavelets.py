@@ -0,0 +1,144 @@
+"""
+Correctness harness for the wavelet kernels in Wavelets.py.
+
+Compares wf of every wavelet family against the per-element loop
+implementations it replaced, evaluated at each scale of a transform, and
+checks that the transform of a test series is unchanged.
+
+Run as
+python check_wavelets.py
+"""
+import numpy as NP
+import Wavelets
+
+#
+# The kernels as they were before wf became an array expression.  Names
+# that were missing from the Wavelets namespace (complex64, sqrt, pi) are
+# taken from numpy.  Arguments are a 1-d s_omega, the order and the
+# current scale.
+#
+def morlet_loop(s_omega, order, currentscale, _omega0=5.0):
+    H= NP.ones(len(s_omega))
+    for i in range(len(s_omega)):
+        if s_omega[i] < 0.0: H[i]=0.0
+    return 0.75112554*( NP.exp(-(s_omega-_omega0)**2/2.0))*H
+
+def morletreal_loop(s_omega, order, currentscale, _omega0=5.0):
+    H= NP.ones(len(s_omega))
+    for i in range(len(s_omega)):
+        if s_omega[i] < 0.0: H[i]=0.0
+    return 0.75112554*( NP.exp(-(s_omega-_omega0)**2/2.0)+ NP.exp(-(s_omega+_omega0)**2/2.0)- NP.exp(-(_omega0)**2/2.0)+ NP.exp(-(_omega0)**2/2.0))
+
+def paul4_loop(s_omega, order, currentscale):
+    n=len(s_omega)
+    xhat= NP.zeros(n)
+    xhat[0:n//2]=0.11268723*s_omega[0:n//2]**4* NP.exp(-s_omega[0:n//2])
+    return xhat
+
+def paul2_loop(s_omega, order, currentscale):
+    n=len(s_omega)
+    xhat= NP.zeros(n)
+    xhat[0:n//2]=1.1547005*s_omega[0:n//2]**2* NP.exp(-s_omega[0:n//2])
+    return xhat
+
+def paul_loop(s_omega, order, currentscale):
+    m=order
+    n=len(s_omega)
+    normfactor=float(m)
+    for i in range(1,2*m):
+        normfactor=normfactor*i
+    normfactor=2.0**m/ NP.sqrt(normfactor)
+    xhat= NP.zeros(n)
+    xhat[0:n//2]=normfactor*s_omega[0:n//2]**m* NP.exp(-s_omega[0:n//2])
+    return xhat
+
+def mexicanhat_loop(s_omega, order, currentscale):
+    a=s_omega**2
+    b=s_omega**2/2
+    return a* NP.exp(-b)/1.1529702
+
+def dog4_loop(s_omega, order, currentscale):
+    return s_omega**4* NP.exp(-s_omega**2/2.0)/3.4105319
+
+def dog1_loop(s_omega, order, currentscale):
+    dog1= NP.zeros(len(s_omega),NP.complex64)
+    dog1.imag=s_omega* NP.exp(-s_omega**2/2.0)/NP.sqrt(NP.pi)
+    return dog1
+
+def dog_loop(s_omega, order, currentscale):
+    from scipy.special import gamma
+    m=order
+    return 1.0J**m*s_omega**m* NP.exp(-s_omega**2/2)/ NP.sqrt(gamma(order+0.5))
+
+def haar_loop(s_omega, order, currentscale):
+    haar= NP.zeros(len(s_omega),NP.complex64)
+    om = s_omega[:]/currentscale
+    om[0]=1.0  #prevent divide error
+    haar.imag=4.0* NP.sin(s_omega/4)**2/om
+    return haar
+
+def haarw_loop(s_omega, order, currentscale):
+    haar= NP.zeros(len(s_omega),NP.complex64)
+    om = s_omega[:]
+    om[0]=1.0  #prevent divide error
+    haar.imag=4.0* NP.sin(s_omega/2)**2/om
+    return haar
+
+# family, reference kernel, relative tolerance.  DOG1, Haar and HaarW
+# were filled into complex64 arrays, so only agree to single precision.
+families = [(Wavelets.Morlet, morlet_loop, 0.0),
+            (Wavelets.MorletReal, morletreal_loop, 0.0),
+            (Wavelets.Paul4, paul4_loop, 0.0),
+            (Wavelets.Paul2, paul2_loop, 0.0),
+            (Wavelets.Paul, paul_loop, 0.0),
+            (Wavelets.MexicanHat, mexicanhat_loop, 0.0),
+            (Wavelets.DOG4, dog4_loop, 0.0),
+            (Wavelets.DOG1, dog1_loop, 1e-6),
+            (Wavelets.DOG, dog_loop, 0.0),
+            (Wavelets.Haar, haar_loop, 1e-6),
+            (Wavelets.HaarW, haarw_loop, 1e-6)]
+
+def check_family(family, reference, rtol, data, order=3, notes=8):
+    """
+    returns the largest relative difference between the kernels and
+    between the transforms of data
+    """
+    ndata = len(data)
+    wavelet = family(data, 4, notes, order=order, scaling="log")
+    omega = NP.array(list(range(0,ndata//2))+list(range(-ndata//2,0)))*(2.0*NP.pi/ndata)
+    psihat = wavelet._psihat(omega, wavelet.scales)
+    kernel_diff = 0.0
+    cwt = NP.zeros((wavelet.nscale,ndata), NP.complex64)
+    for j, currentscale in enumerate(wavelet.scales):
+        s_omega = omega*currentscale
+        # HaarW overwrote s_omega[0] with 1, giving a spurious DC term
+        old = reference(s_omega, order, currentscale)
+        if reference is haarw_loop:
+            old[0] = 0.0
+        wavelet.currentscale = NP.array([[currentscale]])
+        new = wavelet.wf(NP.outer([currentscale], omega))[0]
+        scale = max(NP.abs(old).max(), 1e-300)
+        kernel_diff = max(kernel_diff, NP.abs(new-old).max()/scale)
+        old = old*NP.sqrt(2.0*NP.pi*currentscale)
+        kernel_diff = max(kernel_diff, NP.abs(psihat[j]-old).max()/
+                          max(NP.abs(old).max(), 1e-300))
+        cwt[j] = NP.fft.ifft(old*NP.fft.fft(data))
+    cwt_diff = NP.abs(wavelet.cwt-cwt).max()/NP.abs(cwt).max()
+    return kernel_diff, cwt_diff
+
+def main():
+    NP.random.seed(0)
+    data = NP.cumsum(NP.random.randn(1024))
+    failures = 0
+    for family, reference, rtol in families:
+        kernel_diff, cwt_diff = check_family(family, reference, rtol, data)
+        ok = kernel_diff <= rtol and cwt_diff <= max(rtol, 1e-7)
+        if not ok:
+            failures += 1
+        print('%-12s kernel %.3g  cwt %.3g  %s' % (family.__name__,
+              kernel_diff, cwt_diff, 'ok' if ok else 'FAIL'))
+    return failures
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
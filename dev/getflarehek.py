@@ -8,7 +8,6 @@
 import proba2gi
 from sunpy.lightcurve import LYRALightCurve
 from sunpy.time import TimeRange, parse_time
-from datetime import timedelta
 import pandas
 from matplotlib import pyplot as plt
 import numpy as np
@@ -39,8 +38,11 @@ def main():
     tend = parse_time('2012/07/08')
 
     tinitial = tstart
-    while tstart <= tend:
-        results = do_hurst1_for_one_day(tstart, resample_size, function=functions)
+    # the HEK and LYRA data of the days ahead are fetched while each day is
+    # analysed
+    for gidata in proba2gi.GIData.range(tstart, tend):
+        tstart = gidata.date
+        results = do_hurst1_for_one_day(gidata, resample_size, function=functions)
  
     # Simple analysis of pre and post flare Hurst components
     # Unpack the results into 3 types - before flare, after flare and between
@@ -64,9 +66,6 @@ def main():
             tstart.strftime("%Y%m%d_%H%M%S") + '.hurst.proba2gi.'+resample_size_string+'.pickle'
         pickle.dump(h, open( filepath, "wb" ))
 
-        # Advance
-        tstart = tstart + timedelta(days=1)
-
         # Do the two-sided K-S test
         #for type1 in h.keys():
         #    for type2 in h.keys():
@@ -77,15 +76,15 @@ def save_to_csv(channel, resampled, date, i, j, tstype):
     resampled.to_csv('/Users/ireland/proba2gi/csv/'+channel+'/'+date.strftime("%Y%m%d_%H%M%S")+'_'+str(i)+'_'+str(j)+'_'+tstype+'.csv')
     return None
 
-def do_hurst1_for_one_day(date, resample_size, function=['aggvarFit',
+def do_hurst1_for_one_day(gidata, resample_size, function=['aggvarFit',
                                           'diffvarFit',
                                           'absvalFit',
                                           'rsFit',
                                           'higuchiFit']):
     minimum_length = 10000
     channel = 'CHANNEL3'
-    # Acquire all the relevant data
-    gidata = proba2gi.GIData(date)
+    # All the relevant data of the day, acquired by GIData
+    date = gidata.date
     #gidata.plot(extract='CHANNEL4', show_frm='combine', show_spike=True)
     #event_all_times = gidata.onoff(frm_name='combine').times()
     raw_no_event_times = gidata.onoff(frm_name='combine').complement().times()
@@ -1,9 +1,7 @@
 """Re-doing the analysis to make it more flexible"""
 
-from sunpy.lightcurve import LYRALightCurve
 from sunpy.time import parse_time
-from datetime import timedelta
-from interrogate_hek import fevent
+from prefetch import prefetch, hek_fetcher, lyra_fetcher
 import proba2gi2
 
 
@@ -15,15 +13,17 @@ def main():
     tend = parse_time('2012/07/08')
     channel='CHANNEL4'
 
-    while tstart <= tend:
+    # Get the HEK and PROBA2 data of the days ahead while analysing each day
+    fetchers = {'hek': hek_fetcher(hek_directory), 'lyra': lyra_fetcher}
+    for tstart, data in prefetch(tstart, tend, fetchers, workers=4):
         # Get the HEK data
-        hek = fevent(tstart, directory=hek_directory, verbose=True)
+        hek = data['hek']
         
         # Get the time-ranges of when there is NO event
         non_event_times = hek.onoff(frm_name='combine').complement().times()
         
         # Get the PROBA2 data
-        lyra = LYRALightCurve.create(tstart)
+        lyra = data['lyra']
         
         # Get the spike times in the non flaring data
         spike_times=[]
@@ -52,9 +52,6 @@ def main():
         
         # Save these time-series.
 
-        # Advance
-        tstart = tstart + timedelta(days=1)
-
     # Read in the time series
     
 
@@ -0,0 +1,180 @@
+"""
+Local store of HEK events in an SQLite database.
+
+Each event keeps the HEK fields the analysis needs, with times as seconds
+since 1970-01-01, indexed on event type and time and on frm_name, so a
+time range query of any length is one indexed lookup.  The store also
+records the time ranges it has fetched from the HEK for each event type,
+so that only the gaps in them need to be fetched.
+
+Usage e.g.
+store = HEKStore('~/Data/HEK/hek_events.sqlite')
+for start, end in store.missing('FL', tstart, tend):
+    store.insert(client.query(...), 'FL', start, end)
+events = store.query('FL', tstart, tend)
+"""
+import os
+import sqlite3
+import datetime
+import numpy as np
+
+from intervals import IntervalSet, to_epoch, from_epoch
+
+# HEK fields kept, and their columns
+fields = [('kb_archivid', 'id', 'TEXT PRIMARY KEY'),
+          ('event_type', 'event_type', 'TEXT'),
+          ('frm_name', 'frm_name', 'TEXT'),
+          ('event_starttime', 'starttime', 'REAL'),
+          ('event_endtime', 'endtime', 'REAL'),
+          ('event_peaktime', 'peaktime', 'REAL'),
+          ('fl_goescls', 'goes_class', 'TEXT'),
+          ('hpc_x', 'hpc_x', 'REAL'),
+          ('hpc_y', 'hpc_y', 'REAL')]
+time_fields = ('event_starttime', 'event_endtime', 'event_peaktime')
+
+try:
+    _text_types = (basestring,)
+except NameError:
+    _text_types = (str,)
+
+def epoch_seconds(times):
+    """Seconds since 1970-01-01 of HEK time strings, parsed in one step if
+    they are ISO 8601, or one by one by parse_time if not"""
+    try:
+        return np.array(times, dtype='datetime64[s]').astype(np.int64).astype(float)
+    except ValueError:
+        from sunpy.time import parse_time
+        return to_epoch([parse_time(t) for t in times])
+
+def hek_time(seconds):
+    """HEK time string of seconds since 1970-01-01"""
+    return from_epoch(seconds).strftime('%Y-%m-%dT%H:%M:%S')
+
+def _sql_value(value, kind):
+    """value as it can be bound to a column of kind: numbers as float in
+    REAL columns, and anything else that is not text, such as a list or a
+    dictionary, as its string"""
+    if value is None or isinstance(value, _text_types):
+        return value
+    if kind == 'REAL':
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+    return str(value)
+
+def _seconds(time):
+    if isinstance(time, datetime.datetime):
+        return to_epoch(time)
+    return float(time)
+
+class HEKStore:
+    def __init__(self, filename):
+        """Open, creating if needed, the store in filename"""
+        self.filename = os.path.expanduser(filename)
+        # fetches in other threads or processes may hold the database for a while
+        self.connection = sqlite3.connect(self.filename, timeout=60,
+                                          isolation_level=None)
+        columns = ', '.join('%s %s' % (column, kind) for field, column, kind in fields)
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS events (%s);
+            CREATE INDEX IF NOT EXISTS events_time ON events (event_type, starttime);
+            CREATE INDEX IF NOT EXISTS events_frm ON events (frm_name, starttime);
+            CREATE TABLE IF NOT EXISTS fetched (event_type TEXT, starttime REAL, endtime REAL);
+            CREATE TABLE IF NOT EXISTS longest (event_type TEXT PRIMARY KEY, duration REAL);
+            ''' % columns)
+
+    def close(self):
+        self.connection.close()
+
+    def insert(self, result, event_type, tstart=None, tend=None):
+        """Add the events of a HEK query result (a list of dictionaries),
+        replacing those with the same kb_archivid, and record that the time
+        range tstart to tend has been fetched for event_type"""
+        columns = dict((field, [x.get(field) for x in result]) for field, column, kind in fields)
+        for i, x in enumerate(result):
+            if columns['kb_archivid'][i] is None:
+                # no archive id, so identify the event by what it is
+                columns['kb_archivid'][i] = '%s %s %s %s' % (event_type, x.get('frm_name'),
+                    x.get('event_starttime'), x.get('event_endtime'))
+            if columns['event_type'][i] is None:
+                columns['event_type'][i] = event_type
+        for field in time_fields:
+            values = columns[field]
+            given = [i for i, t in enumerate(values) if t is not None]
+            if given:
+                seconds = epoch_seconds([str(values[i]) for i in given])
+                for i, t in zip(given, seconds):
+                    values[i] = float(t)
+        rows = list(zip(*[[_sql_value(value, kind) for value in columns[field]]
+                          for field, column, kind in fields]))
+        # one transaction, so that concurrent inserts merge fetched ranges in
+        # turn, rolled back on any error so that the database is not left locked
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            if rows:
+                self.connection.executemany('INSERT OR REPLACE INTO events VALUES (%s)' %
+                                            ', '.join('?' * len(fields)), rows)
+                # the longest event bounds the time range lookup
+                durations = [end - start for start, end in
+                             zip(columns['event_starttime'], columns['event_endtime'])
+                             if start is not None and end is not None]
+                self.connection.execute('''INSERT OR REPLACE INTO longest VALUES (?,
+                    MAX(?, COALESCE((SELECT duration FROM longest WHERE event_type = ?), 0)))''',
+                    (event_type, max(durations + [0.0]), event_type))
+            if tstart is not None and tend is not None:
+                # merge the range into those already fetched
+                fetched = self.coverage(event_type) | IntervalSet(_seconds(tstart), _seconds(tend))
+                self.connection.execute('DELETE FROM fetched WHERE event_type = ?', (event_type,))
+                self.connection.executemany('INSERT INTO fetched VALUES (?, ?, ?)',
+                    [(event_type, float(start), float(end)) for start, end in fetched])
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def coverage(self, event_type, tstart=None, tend=None):
+        """The time ranges fetched for event_type as an IntervalSet, only
+        those overlapping tstart to tend if given"""
+        sql = 'SELECT starttime, endtime FROM fetched WHERE event_type = ?'
+        arguments = [event_type]
+        if tstart is not None and tend is not None:
+            sql += ' AND starttime <= ? AND endtime >= ?'
+            arguments += [_seconds(tend), _seconds(tstart)]
+        rows = self.connection.execute(sql, arguments).fetchall()
+        return IntervalSet([row[0] for row in rows], [row[1] for row in rows],
+                           lo=tstart, hi=tend)
+
+    def missing(self, event_type, tstart, tend):
+        """The parts of the time range tstart to tend not yet fetched, as an
+        IntervalSet"""
+        return self.coverage(event_type, tstart, tend).complement()
+
+    def covers(self, event_type, tstart, tend):
+        """Whether the time range tstart to tend has been fetched"""
+        return len(self.missing(event_type, tstart, tend)) == 0
+
+    def query(self, event_type, tstart, tend, frm_name=None):
+        """The events of event_type that overlap the time range tstart to
+        tend, optionally only those of frm_name, as a list of dictionaries
+        with the HEK field names and HEK time strings, sorted by start"""
+        lo, hi = _seconds(tstart), _seconds(tend)
+        longest = self.connection.execute('SELECT duration FROM longest WHERE event_type = ?',
+                                          (event_type,)).fetchone()
+        if longest is None or longest[0] is None:
+            return []
+        sql = '''SELECT * FROM events WHERE event_type = ? AND starttime BETWEEN ? AND ?
+                 AND endtime >= ?'''
+        arguments = [event_type, lo - longest[0], hi, lo]
+        if frm_name is not None:
+            sql += ' AND frm_name = ?'
+            arguments.append(frm_name)
+        events = []
+        for row in self.connection.execute(sql + ' ORDER BY starttime', arguments):
+            x = {}
+            for (field, column, kind), value in zip(fields, row):
+                if field in time_fields and value is not None:
+                    value = hek_time(value)
+                x[field] = value
+            events.append(x)
+        return events
@@ -11,6 +11,14 @@ import pickle
 import pandas
 
 from proba2gi2 import EventTimeRange
+from intervals import IntervalSet, epoch, to_epoch, from_epoch
+from hekstore import HEKStore, epoch_seconds
+
+# The comparisons and logic times() may apply, in place of eval
+comparisons = {'>=': np.greater_equal, '>': np.greater,
+               '<=': np.less_equal, '<': np.less,
+               '==': np.equal, '!=': np.not_equal}
+logic = {'and': np.logical_and, 'or': np.logical_or}
 
 class fevent:
     """
@@ -18,8 +26,11 @@ class fevent:
     results.
     """
     def __init__(self, tstart, tend=None, event_type='FL', extension=None,
-                 directory='~', verbose=False, filename=None):
-        """acquire HEK results from file, or download and save them"""
+                 directory='~', verbose=False, filename=None, store=None,
+                 client=None):
+        """acquire HEK results from the local store, downloading and storing
+        those of the parts of the time range not yet fetched.  Results saved
+        by earlier versions in a pickle file are moved into the store."""
         
         # define the start and end times of the query
         self.tstart = parse_time(tstart)
@@ -46,64 +57,133 @@ class fevent:
             self.filename = self.tstart.strftime("%Y%m%d_%H%M%S") + '__' + \
             self.tend.strftime("%Y%m%d_%H%M%S") + \
             self.extension
+        else:
+            self.filename = filename
 
         # get the full file path
         self.filepath = os.path.join(os.path.expanduser(self.directory), 
                                      self.filename)
+
+        # the local store of events
+        if store is None:
+            store = HEKStore(os.path.join(os.path.expanduser(self.directory),
+                                          'hek_events.sqlite'))
+        self.store = store
     
-        # either load the data or go get it
-        if os.path.isfile(self.filepath):
-            if verbose:
-                print('Loading local file: ' + self.filepath)
-            self.result = pickle.load(open( self.filepath, "rb" ) )
-        else:
+        # go get the parts of the time range the store does not have
+        missing = self.store.missing(self.event_type, self.tstart, self.tend)
+        if len(missing) and os.path.isfile(self.filepath):
             if verbose:
-                print('Querying HEK for data and will save to following file: '+
-                       self.filepath)
-
+                print('Moving local file into the store: ' + self.filepath)
+            self.store.insert(pickle.load(open( self.filepath, "rb" ) ),
+                              self.event_type, self.tstart, self.tend)
+            missing = self.store.missing(self.event_type, self.tstart, self.tend)
+        if len(missing) and client is None:
             client = hek.HEKClient()
-            self.result = client.query(hek.attrs.Time(self.tstart,self.tend), 
+        for start, end in missing:
+            start, end = from_epoch(start), from_epoch(end)
+            if verbose:
+                print('Querying HEK for data from %s to %s and will store it in: %s'
+                      % (start, end, self.store.filename))
+            result = client.query(hek.attrs.Time(start, end),
                                   hek.attrs.EventType(self.event_type))
-            pickle.dump(self.result, open( self.filepath, "wb" ))
+            self.store.insert(result, self.event_type, start, end)
+        if verbose and not len(missing):
+            print('Loading from the store: ' + self.store.filename)
+        self.result = self.store.query(self.event_type, self.tstart, self.tend)
+
+        self.columns()
+
+    def columns(self):
+        """Convert the HEK results to arrays: event start and end times in
+        seconds since 1970-01-01, and the code of the feature recognition
+        method of each event in frms"""
+        self.starts = epoch_seconds([x['event_starttime'] for x in self.result])
+        self.ends = epoch_seconds([x['event_endtime'] for x in self.result])
+        self.frms, self.frm_codes = np.unique([x['frm_name'] for x in self.result],
+                                              return_inverse=True)
+        self.frms = self.frms.tolist()
             
-    def count(self, frm_name='combine', tstart=None, tend=None):
+    def count(self, frm_name='combine', tstart=None, tend=None, freq='S'):
         """Since the same event can be counted by many different algorithms, it
         is interesting to count the number of detections as a function of
-        time in a given time range"""
-        # Create the pandas time series
-        index = pandas.date_range(self.tstart, self.tend, freq = 'S')
-        time_series = pandas.Series(np.zeros(len(index)), dtype=bool,
-                                    index = index)
-        return LightCurve(time_series,header = {"event_type":self.event_type,
-                                                  "frm_name":frm_name})
+        time in a given time range.  Returns a lightcurve sampled every freq
+        with the number of events in progress detected by each
+        feature recognition method (one column each, or only frm_name's),
+        and their sum in the column 'total'."""
+        # Parse and check the input times
+        if tstart is None:
+            tstart = self.tstart
+        if tend is None:
+            tend = self.tend
+        tstart, tend = parse_time(tstart), parse_time(tend)
+        if not(frm_name in self.frms) and frm_name != 'combine':
+            print('frm_name not recognised')
+            return None
+
+        # the events of each feature recognition method counted
+        if frm_name == 'combine':
+            names = self.frms
+            codes = self.frm_codes
+            selected = np.ones(len(self.starts), bool)
+        else:
+            names = [frm_name]
+            selected = self.frm_codes == self.frms.index(frm_name)
+            codes = np.zeros(selected.sum(), int)
+
+        # Create the sample times, as seconds since 1970-01-01
+        index = pandas.date_range(tstart, tend, freq = freq)
+        seconds = (index.asi8 - pandas.Timestamp(epoch).value) / 1e9
+        n = len(seconds)
+
+        # An event is counted in the samples from its start to its end: add
+        # one at the first of them and take one off after the last, then
+        # accumulate
+        first = np.searchsorted(seconds, self.starts[selected], side='left')
+        after = np.searchsorted(seconds, self.ends[selected], side='right')
+        # an event recorded as ending before it starts is not counted
+        after = np.maximum(after, first)
+        counts = np.zeros((len(names), n + 1), np.int32)
+        np.add.at(counts, (codes, first), 1)
+        np.subtract.at(counts, (codes, after), 1)
+        np.cumsum(counts, axis=1, out=counts)
+        counts = counts[:, :n]
+
+        data = pandas.DataFrame(counts.T, index = index, columns = names)
+        data['total'] = counts.sum(axis=0, dtype=np.int32)
+        return LightCurve(data,header = {"event_type":self.event_type,
+                                         "frm_name":frm_name,
+                                         "freq":freq})
 
 
     def onoff(self, frm_name='combine', tstart=None, tend=None, 
               operator = ['>=','<=','and']):
-        """Return a Logical lightcurve object.  The duration of the event is 
-        indicated with the value 'True', and all other values are indicated 
-        with a 'False'.  This is calculated within the range tstart and tend.
+        """Return the times of the events as an IntervalSet over the range of
+        the query, clipped to it.  Like a Logical lightcurve, it has times()
+        and complement(); lightcurve() gives the Logical lightcurve itself,
+        'True' for the duration of the events and 'False' otherwise.
         """
         
         # Get the event start and end times
-        result = self.times(frm_name=frm_name, tstart=tstart, tend=tend, operator=operator)
-
-        # Create the pandas time series
-        index = pandas.date_range(self.tstart, self.tend, freq = 'S')
-        time_series = pandas.Series(np.zeros(len(index)), dtype=bool,
-                                    index = index)
-
-        # Go through each result and get the start and end times
-        for timerange in result:
-            time_series[timerange.start():timerange.end()] = True
-        return LogicalLightCurve.create(time_series,
-                                        header = {"event_type":self.event_type,
-                                                  "frm_name":frm_name})
+        selected = self.select(frm_name=frm_name, tstart=tstart, tend=tend, operator=operator)
+        if selected is None:
+            return None
+
+        lo, hi = to_epoch(self.tstart), to_epoch(self.tend)
+        starts = np.maximum(self.starts[selected], lo)
+        ends = np.minimum(self.ends[selected], hi)
+        return IntervalSet(starts, ends, lo=lo, hi=hi,
+                           header = {"event_type":self.event_type,
+                                     "frm_name":frm_name})
     
-    def times(self, frm_name='combine', tstart=None, tend=None, 
-              operator = ['>=','<=','and']):
-        """Return a list of start and end times within the requested time range
-        with the correct logic on the event time comparison"""
+    def select(self, frm_name='combine', tstart=None, tend=None, 
+               operator = ['>=','<=','and']):
+        """Return a boolean array selecting the events within the requested
+        time range with the correct logic on the event time comparison.
+        operator is the comparison of the event start time with the start of
+        the range, that of the event end time with the end of the range
+        ('None' for no comparison, which counts as False), and the logic
+        combining them."""
 
         # Parse and check the input times
         if tstart is None:
@@ -118,39 +198,42 @@ class fevent:
             print('Start time is larger than the end time')
             return None
 
-        # Get and check the unique feature recognition methods
-        frms = list( set( [ x['frm_name'] for x in self.result ] ) )
-        if not(frm_name in frms) and frm_name != 'combine':
+        # Check the feature recognition method
+        if not(frm_name in self.frms) and frm_name != 'combine':
             print('frm_name not recognised')
             return None
-        
-        # define the index
-        index = pandas.date_range(self.tstart, self.tend, freq = 'S')
+        if operator[0] not in comparisons and operator[0] != 'None' or \
+           operator[1] not in comparisons and operator[1] != 'None' or \
+           operator[2] not in logic:
+            print('operator not recognised')
+            return None
 
         # Limits to the times
-        lo_limit = max( (index[0],tstart) )
-        hi_limit = min( (index[-1],tend) )
-
-        # Go through each result and get the start and end times
-        events = []
-        for x in self.result:
-            event_starttime = parse_time(x['event_starttime'])
-            event_endtime = parse_time(x['event_endtime'])
-            
-            # implement the requested comparison of the event times with
-            # the limit of the extent of the time range
-            if operator[0] == 'None':
-                lo_logic = None
-            else:
-                lo_logic = eval('event_starttime' + operator[0] + 'lo_limit')
-            if operator[1] == 'None':
-                hi_logic = None
-            else:
-                hi_logic = eval('event_endtime' + operator[1] + 'hi_limit')
-            
-            if eval('lo_logic ' + operator[2] + ' hi_logic'):
-                if x['frm_name'] == frm_name:
-                    events.append( EventTimeRange(event_starttime, event_endtime) )
-                elif frm_name == 'combine':
-                    events.append( EventTimeRange(event_starttime, event_endtime) )
-        return events
+        lo_limit = to_epoch(max(self.tstart, tstart))
+        hi_limit = to_epoch(min(self.tend, tend))
+
+        # implement the requested comparison of the event times with
+        # the limit of the extent of the time range
+        if operator[0] == 'None':
+            lo_logic = np.zeros(len(self.starts), bool)
+        else:
+            lo_logic = comparisons[operator[0]](self.starts, lo_limit)
+        if operator[1] == 'None':
+            hi_logic = np.zeros(len(self.ends), bool)
+        else:
+            hi_logic = comparisons[operator[1]](self.ends, hi_limit)
+        selected = logic[operator[2]](lo_logic, hi_logic)
+
+        if frm_name != 'combine':
+            selected &= self.frm_codes == self.frms.index(frm_name)
+        return selected
+
+    def times(self, frm_name='combine', tstart=None, tend=None, 
+              operator = ['>=','<=','and']):
+        """Return a list of start and end times within the requested time range
+        with the correct logic on the event time comparison"""
+        selected = self.select(frm_name=frm_name, tstart=tstart, tend=tend, operator=operator)
+        if selected is None:
+            return None
+        return [EventTimeRange(from_epoch(start), from_epoch(end))
+                for start, end in zip(self.starts[selected], self.ends[selected])]
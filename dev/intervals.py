@@ -0,0 +1,133 @@
+"""
+Sets of time intervals, stored as sorted arrays of start and end times.
+
+Times are held as seconds since 1970-01-01 (UTC); to_epoch and
+from_epoch convert from and to datetime.  The intervals of a set are
+disjoint and sorted, so union, intersection and complement take
+O(E log E) for E intervals, however long the time range they cover.
+"""
+import datetime
+import numpy as np
+
+epoch = datetime.datetime(1970, 1, 1)
+
+def to_epoch(times):
+    """Seconds since 1970-01-01 of a datetime or a sequence of them"""
+    if isinstance(times, datetime.datetime):
+        return (times - epoch).total_seconds()
+    return np.array([(t - epoch).total_seconds() for t in times], dtype=float)
+
+def from_epoch(seconds):
+    """The datetime of seconds since 1970-01-01"""
+    return epoch + datetime.timedelta(seconds=float(seconds))
+
+def _merge(starts, ends):
+    """Sort intervals and merge those that overlap or touch"""
+    order = np.argsort(starts, kind='mergesort')
+    starts = starts[order]
+    ends = ends[order]
+    keep = ends > starts
+    starts, ends = starts[keep], ends[keep]
+    if len(starts) == 0:
+        return starts, ends
+    reach = np.maximum.accumulate(ends)
+    first = np.ones(len(starts), bool)
+    first[1:] = starts[1:] > reach[:-1]
+    last = np.append(np.flatnonzero(first)[1:] - 1, len(starts) - 1)
+    return starts[first], reach[last]
+
+class IntervalSet:
+    """
+    A set of time intervals within the time range lo to hi, which is the
+    range its complement is taken over.  Times are seconds since
+    1970-01-01 or datetimes.
+
+    Usage e.g.
+    events = IntervalSet(starts, ends, lo=tstart, hi=tend)
+    quiet = events.complement()
+    for timerange in quiet.times():
+        print(timerange.start(), timerange.end())
+    """
+    def __init__(self, starts=(), ends=(), lo=None, hi=None, header=None):
+        starts = self._seconds(starts)
+        ends = self._seconds(ends)
+        self.starts, self.ends = _merge(np.atleast_1d(starts), np.atleast_1d(ends))
+        if lo is None:
+            lo = self.starts[0] if len(self.starts) else 0.0
+        if hi is None:
+            hi = self.ends[-1] if len(self.ends) else lo
+        self.lo = self._seconds(lo)
+        self.hi = self._seconds(hi)
+        self.header = header or {}
+
+    def _seconds(self, times):
+        if isinstance(times, datetime.datetime):
+            return to_epoch(times)
+        times = np.asarray(times)
+        if times.dtype == object:
+            return to_epoch(times)
+        return times.astype(float)
+
+    def _new(self, starts, ends, other=None):
+        lo, hi = self.lo, self.hi
+        if other is not None:
+            lo, hi = min(lo, other.lo), max(hi, other.hi)
+        return IntervalSet(starts, ends, lo=lo, hi=hi, header=self.header)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(zip(self.starts, self.ends))
+
+    def union(self, other):
+        return self._new(np.concatenate((self.starts, other.starts)),
+                         np.concatenate((self.ends, other.ends)), other)
+
+    def intersection(self, other):
+        # Both sets are disjoint, so an interval of the intersection starts
+        # at a start and ends at the first end after it where both cover
+        points = np.concatenate((self.starts, other.starts, self.ends, other.ends))
+        steps = np.concatenate((np.ones(len(self) + len(other), int),
+                                -np.ones(len(self) + len(other), int)))
+        order = np.lexsort((steps, points))
+        points, cover = points[order], np.cumsum(steps[order])
+        begin = np.flatnonzero(cover == 2)
+        return self._new(points[begin], points[begin + 1], other)
+
+    def complement(self):
+        """The intervals between lo and hi not in the set"""
+        starts = np.concatenate(([self.lo], self.ends))
+        ends = np.concatenate((self.starts, [self.hi]))
+        return self._new(np.maximum(starts, self.lo), np.minimum(ends, self.hi))
+
+    __or__ = union
+    __and__ = intersection
+
+    def duration(self):
+        """Total length of the intervals in seconds"""
+        return float((self.ends - self.starts).sum())
+
+    def contains(self, times):
+        """Whether each of the times (seconds) is in an interval"""
+        times = np.asarray(times, dtype=float)
+        if len(self) == 0:
+            return np.zeros(times.shape, bool)
+        k = np.searchsorted(self.starts, times, side='right') - 1
+        return (k >= 0) & (times <= self.ends[np.maximum(k, 0)])
+
+    def times(self, timerange=None):
+        """The intervals as a list of sunpy TimeRange, or of timerange"""
+        if timerange is None:
+            from sunpy.time.timerange import TimeRange as timerange
+        return [timerange(from_epoch(start), from_epoch(end)) for start, end in self]
+
+    def lightcurve(self, freq='S'):
+        """The set as a sunpy LogicalLightCurve sampled every freq from lo to
+        hi, True within the intervals"""
+        import pandas
+        from sunpy.lightcurve import LogicalLightCurve
+        index = pandas.date_range(from_epoch(self.lo), from_epoch(self.hi), freq=freq)
+        seconds = (index.asi8 - pandas.Timestamp(epoch).value) / 1e9
+        time_series = pandas.Series(self.contains(seconds), index=index)
+        return LogicalLightCurve.create(time_series, header=self.header)
@@ -0,0 +1,127 @@
+"""
+Fetch the inputs of a day by day analysis ahead of it.
+
+A pool of worker threads runs the fetchers of each day (by default the HEK
+events and the LYRA lightcurve) over a date range, at most a given number
+of days ahead of the analysis, so that downloads and file reads overlap
+the analysis of earlier days.  Days are handed to the analysis in date
+order.  A fetcher is any function of the date; its exceptions are raised
+when the analysis reaches that day.
+
+Usage e.g.
+for date, data in prefetch('2012/06/08', '2012/07/08',
+                           {'hek': hek_fetcher('~/Data/HEK'), 'lyra': lyra_fetcher}):
+    analyse(data['hek'], data['lyra'])
+"""
+import datetime
+import sys
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+def hek_fetcher(directory='~', event_type='FL', verbose=False):
+    """Fetcher of the HEK events of a day, through the local store"""
+    def fetch(date):
+        from interrogate_hek import fevent
+        return fevent(date, event_type=event_type, directory=directory,
+                      verbose=verbose)
+    return fetch
+
+def lyra_fetcher(date):
+    """Fetcher of the LYRA lightcurve of a day, downloading the file if it
+    is not already local"""
+    from sunpy.lightcurve import LYRALightCurve
+    return LYRALightCurve.create(date)
+
+
+def _datetime(time):
+    """time as a datetime, parsing it with sunpy if it is not one"""
+    if isinstance(time, datetime.datetime):
+        return time
+    from sunpy.time import parse_time
+    return parse_time(time)
+
+
+class prefetch:
+    def __init__(self, tstart, tend, fetchers, workers=4, ahead=None,
+                 step=datetime.timedelta(days=1)):
+        """Fetch with fetchers, a dictionary of functions of the date, the
+        days from tstart to tend inclusive, with workers threads and at most
+        ahead days (by default twice workers) not yet handed over"""
+        self.tstart = _datetime(tstart)
+        self.tend = _datetime(tend)
+        self.fetchers = fetchers
+        self.workers = workers
+        self.ahead = ahead or 2*workers
+        self.dates = []
+        date = self.tstart
+        while date <= self.tend:
+            self.dates.append(date)
+            date = date + step
+
+    def _work(self, tasks, results, done):
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            day, name = task
+            try:
+                value = (self.fetchers[name](self.dates[day]), None)
+            except Exception:
+                value = (None, sys.exc_info()[1])
+            with done:
+                results[day][name] = value
+                done.notify_all()
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        tasks = queue.Queue()
+        results = [{} for date in self.dates]
+        done = threading.Condition()
+        threads = [threading.Thread(target=self._work, args=(tasks, results, done))
+                   for i in range(min(self.workers, max(1, len(self.dates))))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        def queue_day(day):
+            if day < len(self.dates):
+                for name in self.fetchers:
+                    tasks.put((day, name))
+
+        finished = False
+        try:
+            for day in range(self.ahead):
+                queue_day(day)
+            for day, date in enumerate(self.dates):
+                with done:
+                    while len(results[day]) < len(self.fetchers):
+                        done.wait()
+                fetched, results[day] = results[day], None
+                queue_day(day + self.ahead)
+                data = {}
+                for name, (value, error) in fetched.items():
+                    if error is not None:
+                        raise error
+                    data[name] = value
+                yield date, data
+            finished = True
+        finally:
+            # drop the fetches not started, and stop the workers
+            try:
+                while True:
+                    tasks.get_nowait()
+            except queue.Empty:
+                pass
+            for thread in threads:
+                tasks.put(None)
+            # after the last day the workers are idle, so wait for them to
+            # stop rather than leave them to interpreter shutdown
+            if finished:
+                for thread in threads:
+                    thread.join()
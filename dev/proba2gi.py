@@ -15,6 +15,7 @@ import pandas
 from rpy2.robjects.packages import importr
 import rpy2.robjects as robjects
 from interrogate_hek import fevent
+from prefetch import prefetch, hek_fetcher, lyra_fetcher
 
 
 
@@ -31,15 +32,21 @@ class SpikeTimeRange(TimeRange):
     
 
 class GIData:
-    def __init__(self, date, directory = '~/Data/', extract='CHANNEL4'):
+    def __init__(self, date, directory = '~/Data/', extract='CHANNEL4',
+                 hek=None, lyra=None):
         """Routine to acquire the relevant data for a particular day for the
-        PROBA2 GI"""
+        PROBA2 GI.  HEK events and LYRA data already fetched can be passed
+        in hek and lyra."""
         # Which date?
         self.date = date
         # Acquire the HEK data
-        self.hek = fevent(self.date, directory=os.path.join(directory,'HEK/'), verbose=True)
+        if hek is None:
+            hek = fevent(self.date, directory=os.path.join(directory,'HEK/'), verbose=True)
+        self.hek = hek
         # Acquire the LYRA data
-        self.lyra = LYRALightCurve.create(self.date)
+        if lyra is None:
+            lyra = LYRALightCurve.create(self.date)
+        self.lyra = lyra
         # Which channel?
         self.extract = extract
         # No event times
@@ -61,6 +68,17 @@ class GIData:
     def onoff(self, frm_name='combine'):
         return self.hek.onoff(frm_name=frm_name)
 
+    @classmethod
+    def range(cls, tstart, tend, directory='~/Data/', extract='CHANNEL4',
+              workers=4):
+        """The GIData of each day from tstart to tend, the HEK and LYRA data
+        of the days ahead fetched by workers threads meanwhile"""
+        fetchers = {'hek': hek_fetcher(os.path.join(directory, 'HEK/'), verbose=True),
+                    'lyra': lyra_fetcher}
+        for date, data in prefetch(tstart, tend, fetchers, workers=workers):
+            yield cls(date, directory=directory, extract=extract,
+                      hek=data['hek'], lyra=data['lyra'])
+
     def plot(self, extract=None, show_frm=None, show_spike=False, show_before_after=False):
 
         if extract is None:
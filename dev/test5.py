@@ -4,8 +4,7 @@ Test code that makes use of the lyra and kPyWavelet code.
 import lyra,lyra_gi
 import matplotlib.pyplot as plt
 import numpy as np
-from scipy.integrate import odeint
-import scipy
+import sys
 
 def main():
     lobj = lyra.lyra('2011/08/09')
@@ -20,22 +19,19 @@ def main():
 
     analyse = lyra_gi.lyra_gi(channel.data, channel.dt)
     analyse.dj = 0.125
-    analyse.neupert()
     plt.figure(1)
     plt.plot(channel.time,channel.data)
     
-    lyra_deriv = analyse.wave.real[0,:]
+    lyra_deriv = analyse.neupert_filter()
     plt.figure(2)
     plt.plot(channel.time,lyra_deriv)
     plt.xlabel = 'time (s)'
     plt.ylabel = 'time derivative of LYRA flux'
     
-    def zzz(u,t,Clyra,lyra_deriv): #defines the system of odes
-        return (lyra_deriv-Clyra*u) #the derivatives of u
-    
+    # Recover the hard X-ray flux u from du/dt = lyra_deriv - Clyra*u
     Clyra = 1.0
     u0 = 1.0
-    hxr = odeint(zzz,u0,channel.time,args=(Clyra,lyra_deriv))
+    hxr = lyra_gi.neupert_inversion(lyra_deriv, channel.dt, Clyra, u0)
     
     plt.figure(3)
     plt.plot(channel.time,hxr)
@@ -18,13 +18,14 @@ channel = lyra.channel(s,4)
 
 analyse = lyra_gi.lyra_gi(channel.data, channel.dt)
 analyse.dj = 0.125
-analyse.neupert()
 plt.figure(1)
 plt.plot(channel.time,channel.data)
 
+# the scale of row 20 of the transform
 this = 20
-print 'Smoothing scale = ',analyse.scale[this]
-lyra_deriv = analyse.wave.real[this,:]
+width = analyse.s0 * 2 ** (this * analyse.dj)
+print 'Smoothing scale = ',width
+lyra_deriv = analyse.neupert_filter(width)
 plt.figure(2)
 plt.plot(channel.time,lyra_deriv)
 plt.xlabel = 'time (s)'
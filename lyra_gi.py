@@ -1,12 +1,573 @@
 """
 LYRA GI code
-Implements the analysis of the LYRA GI 
+Implements the analysis of the LYRA GI
+
+The Fourier transform of the normalised data is computed once and shared
+by every mother wavelet; the results for each mother are kept in the
+results dictionary, keyed by a label such as 'DOG(1)', so that neupert()
+and countFlares() on the same data cost little more than one of them.
+lyra_gi_batch gives the global spectra of many segments at once.
+
+gaussian_derivative is the Neupert operator at a few widths: the rows of
+the DOG(1) transform at those scales, with the same normalisation, but
+without the rest of the transform; invert_neupert integrates it back to a
+hard X-ray proxy (neupert_inversion).  countFlares builds a flare event table
+from ridges of the DOG(2) response, in chunks (flare_events).
+
+Derived products such as power and the significance levels are computed
+only when first used.  lyra_gi(..., lowmem=True) keeps the transform in
+single precision and computes products scale by scale; memory.peak gives
+the peak bytes allocated by each stage, to size batch workers.
+
+The red noise lag-1 autocorrelation alpha is estimated from the data of
+each segment (lag1_autocorrelation, vectorised over many segments), and
+significance levels are kept in a bounded cache, significance_levels,
+shared by all the segments analysed, whatever their alpha.
 """
+from collections import OrderedDict
+from math import gamma
 import kPyWavelet as wvt
 import numpy as np
+from numpy.polynomial import hermite_e
+from scipy.signal import lfilter
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+def mother_label(mother):
+    """A label for a mother wavelet, e.g. 'DOG(2)' or 'Morlet(6.0)'"""
+    for parameter in ('m', 'f0'):
+        if hasattr(mother, parameter):
+            return '%s(%s)' % (mother.__class__.__name__, getattr(mother, parameter))
+    return mother.__class__.__name__
+
+def padded_length(n0):
+    """Length the data are padded to: the next higher power of two"""
+    return 2 ** (int(np.log2(n0)) + 1)
+
+def wavelet_scales(n0, dt, dj, s0, J, mother):
+    """Return the scales and Fourier frequencies of a transform of n0
+    samples, as chosen by wvt.wavelet.cwt"""
+    if s0 == -1:
+        s0 = 2 * dt / mother.flambda()
+    if J == -1:
+        J = int(np.log2(n0 * dt / s0) / dj)
+    sj = s0 * 2. ** (np.arange(0, J + 1) * dj)
+    return sj, 1 / (mother.flambda() * sj)
+
+def gaussian_derivative(data, dt, widths, order=1, method='auto', truncate=8.0, direct_length=129):
+    """The DOG(order) wavelet transform of data at the scales widths (in the
+    units of dt), with the normalisation of wvt.wavelet.cwt.  For order 1
+    this is the Neupert operator: a time derivative of the data smoothed by
+    a Gaussian of standard deviation width, times
+    width * (2 pi width / dt)**0.5 / gamma(1.5)**0.5.
+    data = 1-d array, or 2-d array of series along the last axis
+    widths = one width, or a list of them
+    method = 'direct' convolves with the kernel, truncated at truncate
+        widths, in O(n) per width; 'fft' multiplies the Fourier transform
+        of the data padded as by wvt.wavelet.cwt, in O(n log n), and is the
+        same as the row of the transform; 'auto' convolves if the kernel is
+        at most direct_length samples long
+    Returns an array of shape widths.shape + data.shape.
+    """
+    data = np.asarray(data, dtype=float)
+    widths = np.asarray(widths, dtype=float)
+    n0 = data.shape[-1]
+    norm = 1.0 / np.sqrt(gamma(order + 0.5))
+    hermite = [0] * order + [1]
+    # s omega beyond which the filter is below 1e-300
+    bandwidth = np.sqrt(2 * 690.) + order
+    result = np.empty(widths.shape + data.shape)
+    signal_ft = None
+    for i, s in np.ndenumerate(widths):
+        half = int(np.ceil(truncate * s / dt))
+        if method == 'direct' or (method == 'auto' and 2 * half + 1 <= direct_length):
+            # dt times the inverse Fourier transform of the filter, which is
+            # -He_order(t/s) times the Gaussian of standard deviation s
+            x = np.arange(-half, half + 1) * dt / s
+            kernel = -dt * norm * (2 * np.pi * s / dt) ** .5 * hermite_e.hermeval(x, hermite) * np.exp(-0.5 * x ** 2) / (s * np.sqrt(2 * np.pi))
+            rows = data.reshape(-1, n0)
+            out = result[i].reshape(-1, n0)
+            for j in range(len(rows)):
+                out[j] = np.convolve(rows[j], kernel, 'full')[half:half + n0]
+        elif method in ('auto', 'fft'):
+            # The data and the filter are real, so only the non-negative
+            # frequencies are needed
+            if signal_ft is None:
+                N = padded_length(n0)
+                signal_ft = np.fft.rfft(data, N, axis=-1)
+                ftfreqs = 2 * np.pi * np.arange(N // 2 + 1) / (N * dt)
+            # The filter is only evaluated where it is not negligible
+            band = min(len(ftfreqs), int(np.ceil(bandwidth / (s * ftfreqs[1]))) + 1)
+            f = s * ftfreqs[:band]
+            psi_ft_bar = (s * ftfreqs[1] * N) ** .5 * np.conj(-(1j ** order) * norm) * (f ** order * np.exp(-0.5 * f ** 2))
+            product = np.zeros(signal_ft.shape, complex)
+            product[..., :band] = signal_ft[..., :band] * psi_ft_bar
+            result[i] = np.fft.irfft(product, N, axis=-1)[..., :n0]
+        else:
+            raise ValueError("method must be 'auto', 'direct' or 'fft'")
+    return result
+
+# Flare event table: sample indices of the start, peak and end, the scale
+# (in the units of dt) at which the DOG(2) response is largest, that
+# response, and the amplitude of the peak above the straight line joining
+# the data at the start and end
+flare_dtype = [('start', np.int64), ('peak', np.int64), ('end', np.int64),
+               ('scale', float), ('response', float), ('amplitude', float)]
+
+def _ridges(response, threshold, widths, dt, tolerance=1.0):
+    """Link the local maxima in time of response (nscale, n) that exceed
+    threshold (nscale) into ridges across scales, smallest scale first.  A
+    maximum joins the ridge of the nearest maximum at the scale below if it
+    is within tolerance widths of it and that ridge has not been joined at
+    this scale by a nearer one.  Returns ridge id, scale index and time
+    index of every maximum."""
+    middle = response[:, 1:-1]
+    maxima = ((middle > response[:, :-2]) & (middle >= response[:, 2:]) &
+              (middle > threshold[:, np.newaxis]))
+    scale, time = np.nonzero(maxima)
+    time += 1
+    ridge = np.empty(len(time), np.int64)
+    bounds = np.searchsorted(scale, np.arange(len(widths) + 1))
+    nridge = 0
+    previous = np.zeros(0, np.int64)
+    for j in range(len(widths)):
+        lo, hi = bounds[j], bounds[j + 1]
+        t = time[lo:hi]
+        ids = np.full(len(t), -1, np.int64)
+        if len(previous) and len(t):
+            pt = time[previous]
+            k = np.searchsorted(pt, t)
+            left = np.clip(k - 1, 0, len(pt) - 1)
+            right = np.clip(k, 0, len(pt) - 1)
+            nearest = np.where(np.abs(pt[left] - t) <= np.abs(pt[right] - t), left, right)
+            distance = np.abs(pt[nearest] - t)
+            ok = np.flatnonzero(distance <= tolerance * widths[j] / dt)
+            ok = ok[np.argsort(distance[ok], kind='mergesort')]
+            linked = ok[np.unique(nearest[ok], return_index=True)[1]]
+            ids[linked] = ridge[previous[nearest[linked]]]
+        new = ids < 0
+        ids[new] = np.arange(nridge, nridge + new.sum())
+        nridge += new.sum()
+        ridge[lo:hi] = ids
+        previous = np.arange(lo, hi)
+    return ridge, scale, time
+
+def _flare_table(data, response, widths, dt, nsigma, min_length):
+    """Event table of the flares in data, from its DOG(2) response"""
+    # Robust noise level of the response at each scale, from at most
+    # 2**16 of its samples
+    sample = response[:, ::max(1, response.shape[1] // 2**16)]
+    median = np.median(sample, axis=1)
+    sigma = 1.4826 * np.median(np.abs(sample - median[:, np.newaxis]), axis=1)
+    ridge, scale, time = _ridges(response, nsigma * sigma, widths, dt)
+    if len(ridge) == 0:
+        return np.zeros(0, flare_dtype)
+    value = response[scale, time]
+    # Ridges long enough; the peak is at their smallest scale, the scale
+    # is that of their largest response
+    ids, length = np.unique(ridge, return_counts=True)
+    order = np.lexsort((value, ridge))
+    best = order[np.cumsum(length) - 1]
+    order = np.lexsort((scale, ridge))
+    peak = time[order[np.cumsum(length) - length]]
+    keep = length >= min_length
+    best, peak = best[keep], peak[keep]
+    events = np.zeros(len(best), flare_dtype)
+    events['peak'] = peak
+    events['scale'] = widths[scale[best]]
+    events['response'] = value[best]
+    # The start and end are the zero crossings of the response at the
+    # best scale either side of the ridge there
+    for j in np.unique(scale[best]):
+        this = np.flatnonzero(scale[best] == j)
+        row = response[j]
+        crossings = np.concatenate(([-1], np.flatnonzero(np.signbit(row[:-1]) != np.signbit(row[1:])), [len(row) - 1]))
+        k = np.searchsorted(crossings, time[best[this]])
+        events['start'][this] = crossings[k - 1] + 1
+        events['end'][this] = crossings[k]
+    start = np.minimum(events['start'], peak)
+    end = np.maximum(events['end'], peak)
+    events['start'] = start
+    events['end'] = end
+    baseline = data[start] + (data[end] - data[start]) * (peak - start) / np.maximum(end - start, 1.)
+    events['amplitude'] = data[peak] - baseline
+    return events[np.argsort(events['peak'], kind='mergesort')]
+
+def iter_flare_events(data, dt, widths, nsigma=5.0, min_length=3, chunk=2**19, truncate=5.0):
+    """Detect flares in data in chunks of chunk samples, yielding the event
+    table of each chunk (see flare_events).  data may be a memory mapped
+    array; each chunk is extended by truncate times the largest width on
+    either side, reflecting the data at the ends of the series."""
+    widths = np.sort(np.atleast_1d(np.asarray(widths, dtype=float)))
+    n = len(data)
+    overlap = int(np.ceil(truncate * widths[-1] / dt))
+    for lo in range(0, n, chunk):
+        hi = min(lo + chunk, n)
+        left, right = max(lo - overlap, 0), min(hi + overlap, n)
+        block = np.asarray(data[left:right], dtype=float)
+        before = overlap - (lo - left)
+        after = overlap - (right - hi)
+        if before or after:
+            block = np.pad(block, (before, after), mode='reflect')
+        response = gaussian_derivative(block - block.mean(), dt, widths, order=2, truncate=truncate)
+        events = _flare_table(block, response, widths, dt, nsigma, min_length)
+        offset = left - before
+        events = events[(events['peak'] >= lo - offset) & (events['peak'] < hi - offset)]
+        for field in ('start', 'peak', 'end'):
+            events[field] = np.clip(events[field] + offset, 0, n - 1)
+        yield events
+
+def flare_events(data, dt, widths, nsigma=5.0, min_length=3, chunk=2**19, truncate=5.0):
+    """Flare events in data, found as ridges of local maxima of its DOG(2)
+    (Mexican hat) response across the scales widths.  A maximum counts if
+    it exceeds nsigma times the robust noise level of the response at its
+    scale in its chunk, and a ridge is an event if it spans at least
+    min_length scales.  Returns a table with fields start, peak, end
+    (sample indices), scale, response and amplitude, sorted by peak."""
+    tables = list(iter_flare_events(data, dt, widths, nsigma, min_length, chunk, truncate))
+    return np.concatenate(tables) if tables else np.zeros(0, flare_dtype)
+
+def neupert_inversion(deriv, dt, C, u0=0.0):
+    """Solve du/dt = deriv - C u with u = u0 at the first sample, for the
+    Neupert derivative deriv sampled at cadence dt, taken to be linear
+    between samples.  The exponential integrator
+    u[k+1] = exp(-C dt) u[k] + (a0 - a1) deriv[k] + a1 deriv[k+1]
+    with a0 = (1 - exp(-C dt))/C and a1 = (dt - a0)/(C dt) is then exact,
+    and runs as a recursive filter in one pass.  C may be one value or an
+    array of them; returns an array of shape C.shape + deriv.shape.
+    """
+    deriv = np.asarray(deriv, dtype=float)
+    C = np.asarray(C, dtype=float)
+    result = np.empty(C.shape + deriv.shape)
+    for i, c in np.ndenumerate(C):
+        x = c * dt
+        if abs(x) > 1e-8:
+            decay = np.exp(-x)
+            a0 = -np.expm1(-x) / c
+            a1 = (dt - a0) / x
+        else:
+            # trapezoidal rule, the limit as C goes to 0
+            decay, a0, a1 = 1.0 - x, dt, dt / 2.
+        forcing = np.empty(len(deriv))
+        forcing[0] = u0
+        forcing[1:] = (a0 - a1) * deriv[:-1] + a1 * deriv[1:]
+        result[i] = lfilter([1.0], [1.0, -decay], forcing)
+    return result
+
+def lag1_autocorrelation(segments):
+    """Lag-1 autocorrelation of a 1-d array, of each row of a 2-d array, or
+    of each array in a list of 1-d arrays of any lengths"""
+    if isinstance(segments, np.ndarray) and segments.ndim <= 2:
+        x = np.atleast_2d(segments).astype(float)
+        x = x - x.mean(axis=1)[:, np.newaxis]
+        alpha = (x[:, :-1] * x[:, 1:]).sum(axis=1) / (x * x).sum(axis=1)
+        if segments.ndim < 2:
+            return alpha[0]
+        return alpha
+    # Ragged segments are concatenated, and the sums taken segment by
+    # segment, dropping the products across segment boundaries
+    lengths = np.array([len(segment) for segment in segments])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    x = np.concatenate(segments).astype(float)
+    x -= np.repeat(np.add.reduceat(x, starts) / lengths, lengths)
+    products = np.append(x[:-1] * x[1:], 0.0)
+    products[starts[1:] - 1] = 0.0
+    return np.add.reduceat(products, starts) / np.add.reduceat(x * x, starts)
+
+# alpha is capped at +-alpha_max, short of 1 where the red noise
+# spectrum vanishes
+alpha_max = 1 - 1e-6
+
+def red_noise(alpha, dt, scales, mother):
+    """The red noise spectrum of lag-1 autocorrelation alpha (one value, or
+    an array broadcast against scales) at the Fourier periods of scales,
+    as in wvt.wavelet.significance (Torrence and Compo 1998, equation 16)"""
+    alpha = np.clip(alpha, -alpha_max, alpha_max)
+    freq = dt / (np.asarray(scales) * mother.flambda())
+    return (1 - alpha ** 2) / (1 + alpha ** 2 - 2 * alpha * np.cos(2 * np.pi * freq))
+
+class significance_cache:
+    """
+    Least recently used cache of wvt.wavelet.significance results, keyed by
+    (dt, scales, significance level, mother, sigma_test, dof).  At most
+    maxsize are kept.
+
+    For sigma_test 0 and 1 the levels are the variance times the red noise
+    spectrum of alpha times a chi-square factor that does not depend on
+    alpha (Torrence and Compo 1998, equations 18 and 23).  The factor is
+    cached, and applied to the spectrum of alpha itself, so segments of
+    any alpha share it and the levels are those of wvt.wavelet.significance
+    to rounding.  Other tests are passed through uncached.
+    """
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.levels = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def chisquare(self, dt, scales, sigma_test, slevel, mother, dof=-1):
+        """The levels of white noise of unit variance"""
+        key = (dt, np.asarray(scales).tobytes(), slevel, mother_label(mother),
+               sigma_test, np.asarray(dof).tobytes())
+        if key in self.levels:
+            self.hits += 1
+            chisquare = self.levels.pop(key)
+        else:
+            self.misses += 1
+            # significance writes into an array dof
+            if np.ndim(dof):
+                dof = np.array(dof)
+            chisquare, tmp = wvt.wavelet.significance(1.0, dt, scales, sigma_test, 0.0, significance_level=slevel, dof=dof, wavelet=mother)
+        self.levels[key] = chisquare
+        while len(self.levels) > self.maxsize:
+            self.levels.popitem(last=False)
+        return chisquare
+
+    def significance(self, variance, dt, scales, sigma_test, alpha, slevel, mother, dof=-1):
+        """As wvt.wavelet.significance(variance, dt, scales, sigma_test, alpha,
+        significance_level=slevel, dof=dof, wavelet=mother)"""
+        if sigma_test not in (0, 1):
+            return wvt.wavelet.significance(variance, dt, scales, sigma_test, alpha, significance_level=slevel, dof=dof, wavelet=mother)
+        fft_theor = variance * red_noise(alpha, dt, scales, mother)
+        return fft_theor * self.chisquare(dt, scales, sigma_test, slevel, mother, dof), fft_theor
+
+    def clear(self):
+        self.levels.clear()
+
+    def __len__(self):
+        return len(self.levels)
+
+significance_levels = significance_cache()
+
+# highest peak resident set size seen when stage_memory reset the peak
+_resident_high = 0
+
+def _resident(field):
+    """A size in bytes from /proc/self/status, e.g. VmRSS or VmHWM (peak
+    resident set size), or None if there is none"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])*1024
+    except (IOError, OSError):
+        return None
+
+def _reset_resident_peak():
+    """Reset the peak resident set size of this process to the current
+    one (Linux), and return the current one, or None if that cannot be
+    done here"""
+    global _resident_high
+    peak = _resident('VmHWM')
+    if peak is None:
+        return None
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        return None
+    _resident_high = max(_resident_high, peak)
+    return _resident('VmRSS')
+
+def resident_peak():
+    """Peak resident set size of this process in bytes, including the
+    peaks before stage_memory reset it, or None if it is not known"""
+    peak = _resident('VmHWM')
+    if peak is None:
+        return None
+    return max(peak, _resident_high)
+
+class stage_memory:
+    """
+    Peak bytes allocated by each stage of an analysis, in the dictionary
+    peak.  They are measured with tracemalloc if it is tracing (Python 3.9
+    or later, started with tracemalloc.start() or python -X tracemalloc);
+    otherwise, on Linux, as the rise in peak resident set size, which is
+    rounded to pages and includes allocations other than arrays;
+    otherwise only the bytes of the arrays a stage keeps are counted.
+    Stages may be nested.
+    """
+    def __init__(self):
+        self.peak = {}
+        self._stack = []
+
+    def _tracing(self):
+        return (tracemalloc is not None and tracemalloc.is_tracing() and
+                hasattr(tracemalloc, 'reset_peak'))
+
+    def _measure(self):
+        """The current and peak bytes since the last reset, and whether
+        they are traced, or None if neither can be measured"""
+        if self._tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            return current, peak, True
+        peak = _resident('VmHWM')
+        if peak is None:
+            return None
+        return _resident('VmRSS'), peak, False
+
+    def start(self):
+        measured = self._measure()
+        if measured is None:
+            self._stack.append(None)
+            return
+        current, peak, traced = measured
+        # keep the peak so far of the enclosing stages before resetting
+        for entry in self._stack:
+            if entry is not None:
+                entry[1] = max(entry[1], peak)
+        if traced:
+            tracemalloc.reset_peak()
+        else:
+            current = _reset_resident_peak()
+            if current is None:
+                self._stack.append(None)
+                return
+        self._stack.append([current, current, traced])
+
+    def stop(self, name, kept=()):
+        """End the innermost stage, recording it as name; kept are the
+        arrays it produced, counted if the peak cannot be measured"""
+        entry = self._stack.pop()
+        measured = entry and self._measure()
+        if not measured or measured[2] != entry[2]:
+            nbytes = sum(array.nbytes for array in kept if isinstance(array, np.ndarray))
+        else:
+            current, peak, traced = measured
+            for outer in self._stack:
+                if outer is not None:
+                    outer[1] = max(outer[1], peak)
+            nbytes = max(entry[1], peak) - entry[0]
+        self.peak[name] = max(self.peak.get(name, 0), nbytes)
+
+class transform_result:
+    def __init__(self, gi, mother, label=None):
+        """The wavelet transform of the normalised data of gi by mother.  Same
+        results as wvt.wavelet.cwt, but computed from the Fourier transform
+        cached by gi.  The derived products (iwave, power, sig, glbl_power,
+        significance levels...) are computed when first used; computed()
+        lists those that have been, and release() drops them.
+        If gi.lowmem, the transform and power are single precision, and sig
+        and glbl_power are computed scale by scale without keeping power.
+        """
+        self.mother = mother
+        self.label = label or mother_label(mother)
+        signal_ft, ftfreqs = gi.fourier()
+        n0 = gi.N
+        N = len(signal_ft)
+
+        sj, freqs = wavelet_scales(n0, gi.dt, gi.dj, gi.s0, gi.J, mother)
+
+        # Fill the transform scale by scale using the convolution theorem,
+        # keeping only the unpadded part
+        W = np.zeros((len(sj), n0), np.complex64 if gi.lowmem else complex)
+        for n, s in enumerate(sj):
+            psi_ft_bar = (s * ftfreqs[1] * N) ** .5 * np.conj(mother.psi_ft(s * ftfreqs))
+            W[n, :] = np.fft.ifft(signal_ft * psi_ft_bar, N)[:n0]
+
+        # Remove scales where the transform is not defined
+        sel = np.where(~np.isnan(W).all(axis=1))[0]
+        if len(sel) < len(sj):
+            W = W[sel, :]
+        self.wave = W
+        self.scales = sj[sel]
+        self.freqs = freqs[sel]
+
+        # Cone of influence, in Fourier periods
+        coi = (n0 / 2. - abs(np.arange(0, n0) - (n0 - 1) / 2))
+        self.coi = mother.flambda() * mother.coi() * gi.dt * coi
+        self.fft = signal_ft[1:N // 2] / N ** .5
+        self.fftfreqs = ftfreqs[1:N // 2] / (2. * np.pi)
+
+        self.gi = gi
+
+    # Derived products, computed on first access by the named method
+    products = {'iwave': '_inverse',
+                'power': '_power',
+                'fft_power': '_fft_power',
+                'period': '_period',
+                'signif': '_significance',
+                'fft_theor': '_significance',
+                'sig': '_sig',
+                'glbl_power': '_global',
+                'dof': '_global',
+                'glbl_signif': '_global_significance'}
+
+    def __getattr__(self, name):
+        if name not in self.products:
+            raise AttributeError(name)
+        method = self.products[name]
+        before = set(self.__dict__)
+        self.gi.memory.start()
+        getattr(self, method)()
+        self.gi.memory.stop('%s %s' % (self.label, method[1:]),
+                            [self.__dict__[key] for key in set(self.__dict__) - before])
+        return self.__dict__[name]
+
+    def computed(self):
+        """Return the names of the derived products computed so far"""
+        return sorted(name for name in self.products if name in self.__dict__)
+
+    def release(self, *names):
+        """Drop the named derived products, default all of them; they are
+        computed again if used"""
+        for name in names or self.computed():
+            self.__dict__.pop(name, None)
+
+    def _rowpower(self, j):
+        # Power at scale j
+        row = self.wave[j]
+        return row.real ** 2 + row.imag ** 2
+
+    def _inverse(self):
+        # Inverse wavelet transform
+        self.iwave = wvt.wavelet.icwt(self.wave, self.scales, self.gi.dt, self.gi.dj, self.mother)
+
+    def _power(self):
+        if self.gi.lowmem:
+            self.power = np.empty(self.wave.shape, np.float32)
+            for j in range(len(self.power)):
+                self.power[j] = self._rowpower(j)
+            return
+        self.power = (abs(self.wave)) ** 2             # Normalized wavelet power spectrum
+
+    def _fft_power(self):
+        self.fft_power = self.gi.std2 * abs(self.fft) ** 2     # FFT power spectrum
+
+    def _period(self):
+        self.period = 1. / self.freqs                  # Periods
+
+    def _significance(self):
+        self.signif, self.fft_theor = significance_levels.significance(1.0, self.gi.dt, self.scales, 0, self.gi.alpha, self.gi.slevel, self.mother)
+
+    def _sig(self):
+        if self.gi.lowmem:
+            signif = self.signif.astype(np.float32)
+            self.sig = np.empty(self.wave.shape, np.float32)
+            for j in range(len(self.sig)):
+                if 'power' in self.__dict__:
+                    np.divide(self.power[j], signif[j], self.sig[j])
+                else:
+                    np.divide(self._rowpower(j), signif[j], self.sig[j])
+            return
+        self.sig = self.power / self.signif[:, np.newaxis]   # Where ratio > 1, power is significant
+
+    def _global(self):
+        # Calculates the global wavelet spectrum
+        if 'power' in self.__dict__ or not self.gi.lowmem:
+            self.glbl_power = self.gi.std2 * self.power.mean(axis=1, dtype=np.float64)
+        else:
+            self.glbl_power = self.gi.std2 * np.array([self._rowpower(j).mean(dtype=np.float64) for j in range(len(self.wave))])
+        self.dof = self.gi.N - self.scales                     # Correction for padding at edges
+
+    def _global_significance(self):
+        # Significance level of the global wavelet spectrum
+        self.glbl_signif, tmp = significance_levels.significance(self.gi.std2, self.gi.dt, self.scales, 1, self.gi.alpha, self.gi.slevel, self.mother, dof=self.dof)
 
 class lyra_gi:
-    def __init__(self,data,dt):
+    def __init__(self,data,dt,alpha=None,lowmem=False):
         """Torrence and Compo based analysis
         data = time series of length N
         dt = sample cadence
@@ -16,6 +577,11 @@ class lyra_gi:
         s0 = the smallest scale of the wavelet.  Default is 2*DT.
         J  = the # of scales minus one. Scales range from S0 up to S0*2^(J*DJ),
             to give a total of (J+1) scales. Default is J = (LOG2(N DT/S0))/DJ.
+        alpha = lag-1 autocorrelation of the red noise background.  Default
+            is that of the data.
+        lowmem = single precision transforms, derived products computed
+            scale by scale; see transform_result
+        memory.peak = peak bytes allocated by each stage, see stage_memory
         """
         self.data = data
         self.dt = dt
@@ -27,43 +593,205 @@ class lyra_gi:
         self.std = data.std()
         self.std2 = self.std ** 2
         self.normed = (self.data - self.data.mean())/self.std
-        self.alpha = 0.0
-
-    def transform(self):
+        if alpha is None:
+            alpha = lag1_autocorrelation(self.normed)
+        self.alpha = alpha
+        self.lowmem = lowmem
+        self.memory = stage_memory()
+        self.results = {}
+        self.settings = None
+        self.current = None
+        self._signal_ft = None
 
-        # Do the wavelet transform
-        self.wave, self.scales, self.freqs, self.coi, self.fft, self.fftfreqs = wvt.wavelet.cwt(self.normed, self.dt, self.dj, self.s0, self.J, self.mother)
-
-        # Inverse wavelet transform
-        self.iwave = wvt.wavelet.icwt(self.wave, self.scales, self.dt, self.dj, self.mother)
-
-        self.power = (abs(self.wave)) ** 2             # Normalized wavelet power spectrum
-        self.fft_power = self.std2 * abs(self.fft) ** 2     # FFT power spectrum
-        self.period = 1. / self.freqs                  # Periods
+    def __getattr__(self, name):
+        # wave, scales, power... are those of the most recent transform
+        if name.startswith('_') or self.current is None:
+            raise AttributeError(name)
+        return getattr(self.results[self.current], name)
 
-        self.signif, self.fft_theor = wvt.wavelet.significance(1.0, self.dt, self.scales, 0, self.alpha, significance_level=self.slevel, wavelet=self.mother)
-        sig = (self.signif * np.ones((self.N, 1))).transpose()
-        self.sig = self.power / sig                # Where ratio > 1, power is significant
-
-        # Calculates the global wavelet spectrum and determines its significance level.
-        self.glbl_power = self.std2 * self.power.mean(axis=1)
-        self.dof = self.N - self.scales                     # Correction for padding at edges
-        self.glbl_signif, tmp = wvt.wavelet.significance(self.std2, self.dt, self.scales, 1, self.alpha, significance_level=self.slevel, dof=self.dof, wavelet=self.mother)
+    def fourier(self):
+        """Return the Fourier transform of the normalised data, padded to the
+        next higher power of two, and its angular frequencies"""
+        if self._signal_ft is None:
+            self.memory.start()
+            N = padded_length(self.N)
+            self._signal_ft = np.fft.fft(self.normed, N)
+            self._ftfreqs = 2 * np.pi * np.fft.fftfreq(N, self.dt)
+            self.memory.stop('fourier', [self._signal_ft, self._ftfreqs])
+        return self._signal_ft, self._ftfreqs
 
+    def transform(self, mother=None, label=None):
+        """Wavelet transform of the normalised data by mother (default
+        self.mother).  The result is kept in self.results[label], label
+        defaulting to that of the mother, and is returned; its products are
+        also available as attributes of self, e.g. self.wave.  The results
+        are dropped if slevel, dj, s0, J or lowmem has changed since they
+        were computed.
+        """
+        if mother is None:
+            mother = self.mother
+        self.mother = mother
+        if label is None:
+            label = mother_label(mother)
+        settings = (self.slevel, self.dj, self.s0, self.J, self.lowmem)
+        if settings != self.settings:
+            self.results = {}
+            self.current = None
+            self.settings = settings
+        if label not in self.results:
+            self.memory.start()
+            result = transform_result(self, mother, label)
+            self.memory.stop('%s transform' % label, [result.wave])
+            self.results[label] = result
+        self.current = label
+        return self.results[label]
 
     def neupert(self):
         """Implement the "Neupert operator" - this smooths the time series by the
         Gaussian width and takes the derivative simultaneously.  Implemented using
         the Torrence and Compo first derivative of Gaussian wavelet.
         """
-        self.mother = wvt.wavelet.DOG(1)          # Neupert operator - first derivative of Gaussian
-        self.transform()
+        # Neupert operator - first derivative of Gaussian
+        return self.transform(wvt.wavelet.DOG(1))
+
+    def neupert_filter(self, widths=None):
+        """The Neupert operator of the normalised data at one or a few widths
+        (default s0) only; the same as rows of neupert().wave.real, at much
+        less cost.  See gaussian_derivative.
+        """
+        if widths is None:
+            widths = self.s0
+        return gaussian_derivative(self.normed, self.dt, widths)
+
+    def invert_neupert(self, C, u0=0.0, widths=None):
+        """The hard X-ray proxy u recovered from the Neupert operator at
+        width widths (default s0) by du/dt = neupert - C u, for one value or
+        an array of values of C; see neupert_inversion.
+        """
+        return neupert_inversion(self.neupert_filter(widths), self.dt, C, u0)
+
+    def countFlares(self, widths=None, nsigma=5.0, min_length=3, chunk=2**19):
+        """Count the number of flare events in a LYRA time series.  Returns
+        the event table (see flare_events), also kept as self.flares; widths
+        default to half octaves from s0 to 1/16 of the duration of the data,
+        at most 2048 seconds.
+        """
+        if widths is None:
+            largest = min(self.N * self.dt / 16., 2048.)
+            widths = self.s0 * 2. ** np.arange(0, np.log2(largest / self.s0) + 0.5, 0.5)
+        self.flares = flare_events(self.data, self.dt, widths, nsigma, min_length, chunk)
+        return self.flares
+
+
+class batch_result:
+    def __init__(self, batch, mother):
+        """Global wavelet spectra of the segments of batch by mother, and
+        their significance levels.  glbl_power, glbl_signif, scales and
+        period are 2-d arrays, one row per segment, if all the segments
+        have the same length, and lists of arrays otherwise.
+        """
+        self.mother = mother
+        nsegment = len(batch.std2)
+        glbl_power = [None] * nsegment
+        glbl_signif = [None] * nsegment
+        scales = [None] * nsegment
+        for n0, index in batch.groups.items():
+            signal_ft, ftfreqs = batch.fourier(n0)
+            N = len(ftfreqs)
+            sj, freqs = wavelet_scales(n0, batch.dt, batch.dj, batch.s0, batch.J, mother)
+            # Mean power over time at each scale, the segments in chunks
+            # of at most batch.maxbytes of transform
+            power = np.empty((len(index), len(sj)))
+            step = max(1, batch.maxbytes // (16 * N))
+            for n, s in enumerate(sj):
+                psi_ft_bar = (s * ftfreqs[1] * N) ** .5 * np.conj(mother.psi_ft(s * ftfreqs))
+                for lo in range(0, len(index), step):
+                    W = np.fft.ifft(signal_ft[lo:lo + step] * psi_ft_bar, N, axis=1)[:, :n0]
+                    power[lo:lo + step, n] = (W.real ** 2 + W.imag ** 2).mean(axis=1)
+            # Remove scales where the transform is not defined
+            sel = np.where(~np.isnan(power).all(axis=0))[0]
+            sj = sj[sel]
+            power = power[:, sel] * batch.std2[index][:, np.newaxis]
+            # The white noise levels, times the red noise spectrum of the
+            # alpha and the variance of each segment
+            dof = n0 - sj
+            level = significance_levels.chisquare(batch.dt, sj, 1, batch.slevel, mother, dof=dof)
+            signif = batch.std2[index][:, np.newaxis] * level * \
+                red_noise(batch.alpha[index][:, np.newaxis], batch.dt, sj, mother)
+            for i, j in enumerate(index):
+                glbl_power[j] = power[i]
+                glbl_signif[j] = signif[i]
+                scales[j] = sj
+        if len(batch.groups) == 1:
+            glbl_power = np.array(glbl_power)
+            glbl_signif = np.array(glbl_signif)
+            scales = np.array(scales)
+        self.glbl_power = glbl_power
+        self.glbl_signif = glbl_signif
+        self.scales = scales
+        self.period = [mother.flambda() * sj for sj in scales]
+        if len(batch.groups) == 1:
+            self.period = np.array(self.period)
+
+class lyra_gi_batch:
+    # largest transform held at once, in bytes
+    maxbytes = 2**27
 
-    def countFlares(self):
-        """Count the number of flare events in a LYRA time series.
+    def __init__(self,segments,dt,alpha=None):
+        """Torrence and Compo global wavelet spectra of many segments
+        segments = 2-d array, one segment per row, or a list of 1-d arrays
+            of any lengths, all with the same cadence
+        dt = sample cadence
+        alpha = lag-1 autocorrelation of the red noise background, one value
+            or one per segment.  Default is that of each segment.
+        slevel, dj, s0, J = as lyra_gi
+        Segments of the same length are normalised and transformed together.
         """
-        self.mother = wvt.wavelet.DOG(2)
-        self.transform()
-        
-        
-        
\ No newline at end of file
+        self.dt = dt
+        self.slevel = 0.95
+        self.s0 = 2.0*self.dt
+        self.dj = 0.25
+        self.J = -1
+        lengths = np.array([len(segment) for segment in segments])
+        self.groups = OrderedDict((n0, np.flatnonzero(lengths == n0)) for n0 in np.unique(lengths))
+        self.std2 = np.empty(len(segments))
+        self.normed = {}
+        for n0, index in self.groups.items():
+            if isinstance(segments, np.ndarray):
+                data = segments[index]
+            else:
+                data = np.array([segments[i] for i in index])
+            std = data.std(axis=1)
+            self.std2[index] = std ** 2
+            self.normed[n0] = (data - data.mean(axis=1)[:, np.newaxis]) / std[:, np.newaxis]
+        if alpha is None:
+            alpha = lag1_autocorrelation(segments)
+        self.alpha = alpha * np.ones(len(segments))
+        self.results = {}
+        self.settings = None
+        self._signal_ft = {}
+
+    def fourier(self, n0):
+        """Return the Fourier transforms of the normalised segments of length
+        n0, padded to the next higher power of two, and their angular
+        frequencies"""
+        if n0 not in self._signal_ft:
+            N = padded_length(n0)
+            self._signal_ft[n0] = (np.fft.fft(self.normed[n0], N, axis=1),
+                                   2 * np.pi * np.fft.fftfreq(N, self.dt))
+        return self._signal_ft[n0]
+
+    def transform(self, mother, label=None):
+        """Global wavelet spectra of the segments by mother.  The result is
+        kept in self.results[label], label defaulting to that of the mother,
+        and is returned.  The results are dropped if slevel, dj, s0 or J has
+        changed since they were computed."""
+        if label is None:
+            label = mother_label(mother)
+        settings = (self.slevel, self.dj, self.s0, self.J)
+        if settings != self.settings:
+            self.results = {}
+            self.settings = settings
+        if label not in self.results:
+            self.results[label] = batch_result(self, mother)
+        return self.results[label]